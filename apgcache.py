@@ -0,0 +1,68 @@
+'''A bounded cache of apgcode classifications, used to avoid reclassifying common objects.'''
+import json
+from collections import OrderedDict
+class ApgcodeCache:
+    '''Maps normalised cells and their states to (apgcode, period, displacement), discarding the least recently used.'''
+    def __init__(self, rule, maxsize=65536):
+        self.rule = rule
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def __deepcopy__(self, memo):
+        '''The cache is shared between copies of a Lifetree.'''
+        return self
+    def __len__(self):
+        return len(self.entries)
+    def key(self, grid):
+        '''Returns the cells of a grid as (x, y, state), moved so that the bounding box starts at the origin, in sorted order.
+States are part of the key, since cells in different states of a Generations rule evolve differently.'''
+        cells = [x for x in grid if grid[x] != 0]
+        if len(cells) == 0:
+            return ()
+        x = min(c[0] for c in cells)
+        y = min(c[1] for c in cells)
+        return tuple(sorted((c[0] - x, c[1] - y, grid[c]) for c in cells))
+    def get(self, key):
+        '''Returns a cached classification, or None if it is missing.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+    def add(self, key, apgcode, period, displacement):
+        '''Stores a classification, evicting the least recently used if full.'''
+        self.entries[key] = (apgcode, period, displacement)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+    def clear(self):
+        '''Empties the cache and resets the statistics.'''
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+    @property
+    def hitrate(self):
+        '''The fraction of lookups that were found in the cache.'''
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+    def save(self, filename='apgcache.json'):
+        '''Saves the cache to a file so it can be used as a warm start.'''
+        entries = [[list(map(list, key)), value[0], value[1], value[2]] for key, value in self.entries.items()]
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({'rule': self.rule, 'entries': entries}, f)
+    def load(self, filename='apgcache.json'):
+        '''Loads entries saved by save(). The rule must match.'''
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data['rule'] != self.rule:
+            raise ValueError('Cache was saved for rule '+data['rule']+', not '+self.rule+'.')
+        for cells, apgcode, period, displacement in data['entries']:
+            if displacement is not None:
+                displacement = tuple(displacement)
+            #Caches saved before states were part of the key only hold (x, y) for cells in state 1:
+            self.add(tuple((c[0], c[1], c[2] if len(c) > 2 else 1) for c in cells), apgcode, period, displacement)
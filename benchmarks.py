@@ -0,0 +1,211 @@
+'''Times a standard corpus of workloads on every available implementation and engine, with peak memory.
+Results are plain dictionaries that can be saved as JSON and compared between runs, e.g.
+python benchmarks.py --scale 0.1 --output before.json
+python benchmarks.py --scale 0.1 --output after.json --compare before.json'''
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+try:
+    from .lifetree import Lifetree, ENGINES
+except ImportError:
+    from lifetree import Lifetree, ENGINES
+try:
+    from .numpylife import np
+except ImportError:
+    from numpylife import np
+#Patterns used by the corpus:
+RPENTOMINO = 'x = 3, y = 3, rule = B3/S23\nb2o$2o$bo!'
+GOSPERGUN = '''x = 36, y = 9, rule = B3/S23
+24bo$22bobo$12b2o6b2o12b2o$11bo3bo4b2o12b2o$2o8bo5bo3b2o$2o8bo3bob2o4b
+obo$10bo5bo7bo$11bo3bo$12b2o!'''
+#The most common objects in C1 soups, and a few higher-period oscillators:
+COMMONOBJECTS = ['xs4_33', 'xp2_7', 'xs6_696', 'xq4_153', 'xs7_2596', 'xs5_253', 'xs6_356', 'xs4_252', 'xs8_6996',
+                 'xs7_25ac', 'xs6_25a4', 'xp2_7e', 'xs8_3pm', 'xs12_g8o653z11', 'xp15_4r4z4r4', 'xp3_co9nas0san9oczgoldlo0oldlogz1047210127401']
+#Workloads that step patterns are run on every engine, and the rest once per implementation:
+def setuprpentomino(lt, scale):
+    return lt.pattern(RPENTOMINO).grid
+def runrpentomino(lt, grid):
+    lt.stabilise(grid)
+def setupgosper(lt, scale):
+    return (lt.pattern(GOSPERGUN), max(1, int(10000 * scale)))
+def rungosper(lt, state):
+    pt, gens = state
+    pt[gens].population
+def setupsoup(lt, scale):
+    #A single 16 by 16 soup, the unit of work of a soup search:
+    return (lt.hashsoup('k_numpy0', 'C1').grid, max(1, int(3000 * scale)))
+def runsoup(lt, state):
+    grid, gens = state
+    lt.advance(grid, gens)
+def setupdense(lt, scale):
+    rng = random.Random(0)
+    #A 200 by 200 field at density 1/2, which stays dense for hundreds of generations:
+    grid = {(x, y): 1 for x in range(200) for y in range(200) if rng.random() < 0.5}
+    return (grid, max(1, int(100 * scale)))
+def rundense(lt, state):
+    grid, gens = state
+    lt.advance(grid, gens)
+def setuplongsoups(lt, scale):
+    #Most of each soup settles long before the end, which is the case the incremental engine is for:
+    soups = lt.hashsoups(['k_long' + str(n) for n in range(4)], 'C1')
+    return ([soup.grid for soup in soups], max(1, int(4000 * scale)))
+def runlongsoups(lt, state):
+    grids, gens = state
+    for grid in grids:
+        lt.advance(grid, gens)
+def setuphashsoups(lt, scale):
+    return ['k_benchmark' + str(n) for n in range(max(1, int(10000 * scale)))]
+def runhashsoups(lt, seeds):
+    lt.hashsoups(seeds, 'C1')
+def setupapgcodes(lt, scale):
+    return [lt.pattern(x) for x in COMMONOBJECTS]
+def runapgcodes(lt, patterns):
+    #Every object is classified from scratch, rather than found in the cache:
+    lt.apgcache.clear()
+    for pt in patterns:
+        pt.clone().apgcode
+def setuprle(lt, scale):
+    rng = random.Random(0)
+    cells = max(1, int(1000000 * scale))
+    #A random pattern at density 1/4, so runs of every length appear:
+    side = int((4 * cells) ** 0.5) + 1
+    grid = {}
+    while len(grid) < cells:
+        grid[(rng.randrange(side), rng.randrange(side))] = 1
+    return lt.pattern(grid)
+def runrle(lt, pt):
+    lt.pattern(pt.clone().rle)
+def setupcomponents(lt, scale):
+    soups = lt.hashsoups(['k_ash' + str(n) for n in range(max(1, int(20 * scale)))], 'C1')
+    #Spread the ash of each soup along a row, far enough apart not to touch:
+    return lt.combine([lt.pattern(lt.stabilise(soup.grid))(1000 * n, 0) for n, soup in enumerate(soups)])
+def runcomponents(lt, ash):
+    ash.clone().components
+WORKLOADS = [
+    ('rpentomino', 'R-pentomino to stabilisation', True, setuprpentomino, runrpentomino),
+    ('gosper', 'Gosper glider gun to 10000 generations', True, setupgosper, rungosper),
+    ('soup', 'a 16x16 C1 soup to 3000 generations', True, setupsoup, runsoup),
+    ('dense', 'random 200x200 field to 100 generations', True, setupdense, rundense),
+    ('longsoups', '4 C1 soups to 4000 generations', True, setuplongsoups, runlongsoups),
+    ('hashsoups', '10000 C1 hashsoups', False, setuphashsoups, runhashsoups),
+    ('apgcodes', 'apgcodes of common objects', False, setupapgcodes, runapgcodes),
+    ('rle', 'RLE round trip of a 1000000 cell pattern', False, setuprle, runrle),
+    ('components', 'components of the ash of 20 soups', False, setupcomponents, runcomponents)
+    ]
+def implementations():
+    '''Returns the available Lifetree classes by name: the pure Python one, and the Cython one if it has been compiled.'''
+    found = {'python': Lifetree}
+    try:
+        import cylifetree
+        found['cython'] = cylifetree.Lifetree
+    except ImportError:
+        #cython_compile() has not been run.
+        pass
+    return found
+def measure(function, arguments, repeat=1, memory=True):
+    '''Times function(*arguments), returning the best time in seconds over repeat runs and the peak memory of one more run in bytes.
+Memory is traced in a separate run, since tracing slows Python down.'''
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        function(*arguments)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+def run(workloads=None, engines=None, scale=1.0, repeat=1, memory=True, report=None):
+    '''Runs the corpus on every available implementation and engine, returning a dictionary with the results.
+workloads and engines may restrict the run to some names, and scale shrinks or grows the workloads.
+If report is given (e.g print), it is called with a line of text as each result finishes.'''
+    if workloads is None:
+        workloads = [x[0] for x in WORKLOADS]
+    if engines is None:
+        engines = ENGINES
+    results = []
+    for implementation, lifetreeclass in implementations().items():
+        for name, description, stepping, setup, function in WORKLOADS:
+            if name not in workloads:
+                continue
+            for engine in (engines if stepping else ['python']):
+                try:
+                    lt = lifetreeclass('b3s23', engine)
+                except ImportError:
+                    #The numpy engine needs NumPy to be installed.
+                    continue
+                state = setup(lt, scale)
+                seconds, peak = measure(function, (lt, state), repeat, memory)
+                result = {'workload': name, 'implementation': implementation, 'engine': engine if stepping else None,
+                          'seconds': seconds, 'peakmemory': peak}
+                results.append(result)
+                if report is not None:
+                    report(formatresult(result))
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': None if np is None else np.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'scale': scale, 'repeat': repeat, 'results': results}
+def resultkey(result):
+    '''Identifies a result across runs.'''
+    return (result['workload'], result['implementation'], result['engine'])
+def formatresult(result):
+    '''Formats a result as one line of text.'''
+    name = result['workload'] + ' [' + result['implementation'] + (', ' + result['engine'] if result['engine'] else '') + ']'
+    line = name.ljust(40) + ('%.4f s' % result['seconds']).rjust(12)
+    if result['peakmemory'] is not None:
+        line += ('%.1f MiB' % (result['peakmemory'] / 2**20)).rjust(12)
+    return line
+def compare(old, new, threshold=1.1):
+    '''Compares two runs, returning a list of (workload, implementation, engine, ratio, regressed) for results in both.
+ratio is the new time divided by the old, and regressed is True if it is above threshold.'''
+    if old.get('scale') != new.get('scale'):
+        raise ValueError('Cannot compare runs with different scales: '+str(old.get('scale'))+' and '+str(new.get('scale')))
+    before = {resultkey(x): x for x in old['results']}
+    comparison = []
+    for result in new['results']:
+        key = resultkey(result)
+        if key not in before or before[key]['seconds'] == 0:
+            continue
+        ratio = result['seconds'] / before[key]['seconds']
+        comparison.append(key + (ratio, ratio > threshold))
+    return comparison
+def save(results, filename='benchmarks.json'):
+    '''Saves the results of a run as JSON.'''
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+def load(filename='benchmarks.json'):
+    '''Loads the results of a run saved by save().'''
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+def main(arguments=None):
+    '''Runs the benchmarks from the command line. Returns 1 if a comparison finds a regression.'''
+    parser = argparse.ArgumentParser(description='Times a standard corpus of workloads on every available engine.')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the size of every workload')
+    parser.add_argument('--repeat', type=int, default=1, help='runs each workload this many times and keeps the best')
+    parser.add_argument('--workloads', nargs='*', help='only runs these workloads: '+' '.join(x[0] for x in WORKLOADS))
+    parser.add_argument('--engines', nargs='*', help='only runs these engines: '+' '.join(ENGINES))
+    parser.add_argument('--nomemory', action='store_true', help='skips measuring peak memory')
+    parser.add_argument('--output', help='saves the results as JSON')
+    parser.add_argument('--compare', help='compares the results with a run saved earlier')
+    parser.add_argument('--threshold', type=float, default=1.1, help='the slowdown counted as a regression')
+    arguments = parser.parse_args(arguments)
+    results = run(arguments.workloads, arguments.engines, arguments.scale, arguments.repeat, not arguments.nomemory, print)
+    if arguments.output:
+        save(results, arguments.output)
+    if arguments.compare:
+        regressed = False
+        for workload, implementation, engine, ratio, slower in compare(load(arguments.compare), results, arguments.threshold):
+            name = workload + ' [' + implementation + (', ' + engine if engine else '') + ']'
+            print(name.ljust(40) + ('%.2fx' % ratio).rjust(12) + ('  REGRESSION' if slower else ''))
+            regressed = regressed or slower
+        return 1 if regressed else 0
+    return 0
+if __name__ == '__main__':
+    sys.exit(main())
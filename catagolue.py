@@ -0,0 +1,100 @@
+'''A client for fetching many pages from Catagolue, or a local stand-in, over reused connections with an on-disk cache.'''
+import hashlib
+import http.client
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+#Errors that mean a kept-alive connection was closed by the server, so the request can be retried once:
+RETRYERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError)
+SCHEMES = {'http': http.client.HTTPConnection, 'https': http.client.HTTPSConnection}
+class CatagolueClient:
+    '''Fetches text over HTTP, keeping at most connections requests in flight and reusing their connections.
+If cachedir is set, responses are kept there as files and reused until they are expiry seconds old.'''
+    def __init__(self, cachedir=None, expiry=86400, connections=4, timeout=30):
+        self.cachedir = cachedir
+        self.expiry = expiry
+        self.connections = connections
+        self.timeout = timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+    def __deepcopy__(self, memo):
+        '''The client and its connections are shared between copies of a Lifetree.'''
+        return self
+    def __getstate__(self):
+        '''Connections and locks cannot be sent to other processes, so only the settings are kept.'''
+        return (self.cachedir, self.expiry, self.connections, self.timeout)
+    def __setstate__(self, state):
+        self.__init__(*state)
+    def close(self):
+        '''Closes every idle connection.
+The pools are emptied in place, so a request still running can return its connection afterwards.'''
+        with self.lock:
+            for pool in self.pools.values():
+                for connection in pool:
+                    connection.close()
+                pool.clear()
+    def request(self, url):
+        '''Fetches a URL over a pooled connection, returning the response as text.'''
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in SCHEMES:
+            raise ValueError('Only the following URL schemes are supported: '+str(list(SCHEMES)))
+        key = (parts.scheme, parts.netloc)
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            connection = pool.pop() if pool else None
+        if connection is None:
+            connection = SCHEMES[parts.scheme](parts.netloc, timeout=self.timeout)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        for attempt in range(2):
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                #The whole body must be read before the connection can be used again:
+                body = response.read()
+                break
+            except RETRYERRORS:
+                connection.close()
+                if attempt == 1:
+                    raise
+            except Exception:
+                connection.close()
+                raise
+        with self.lock:
+            self.pools.setdefault(key, []).append(connection)
+        if response.status != 200:
+            raise OSError('Request for '+url+' failed with HTTP status '+str(response.status)+'.')
+        return body.decode('utf-8')
+    def cachefile(self, url):
+        '''Returns the file used to cache a URL.'''
+        return os.path.join(self.cachedir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.txt')
+    def fetch(self, url):
+        '''Fetches a URL, using the cached response if it has not expired.'''
+        if self.cachedir is None:
+            return self.request(url)
+        filename = self.cachefile(url)
+        try:
+            if time.time() - os.path.getmtime(filename) < self.expiry:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    return f.read()
+        except OSError:
+            #The response has not been cached yet.
+            pass
+        text = self.request(url)
+        os.makedirs(self.cachedir, exist_ok=True)
+        #Write to a temporary file first, so that other threads and processes never see part of a response:
+        temporary = filename + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temporary, filename)
+        return text
+    def fetchmany(self, urls):
+        '''Fetches many URLs concurrently over at most self.connections connections, returning their text in order.'''
+        urls = list(urls)
+        if len(urls) <= 1 or self.connections <= 1:
+            return [self.fetch(x) for x in urls]
+        with ThreadPoolExecutor(min(self.connections, len(urls))) as executor:
+            return list(executor.map(self.fetch, urls))
@@ -0,0 +1,73 @@
+'''A binary pattern format holding the packed keys of a CellSet, which can be memory-mapped without copying.'''
+import mmap
+import struct
+import sys
+from array import array
+try:
+    from .cellset import CellSet
+except ImportError:
+    from cellset import CellSet
+#Files start with a fixed header, then the rule padded to 8 bytes, then the sorted
+#little-endian 64-bit keys, so the keys are always 8-byte aligned within the file.
+#Multi-state cells are followed by one byte per cell holding its state:
+MAGIC = b'PLCS'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIQ4q')
+EXTENSION = '.cellset'
+def iscellfile(source):
+    '''Checks whether a filename or bytes-like object holds a binary pattern.'''
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    return bytes(memoryview(source)[:len(MAGIC)]) == MAGIC
+def writecellfile(f, cells, rule):
+    '''Writes a CellSet and its rule to a binary file object.'''
+    rule = rule.encode('utf-8')
+    bbox = cells.bbox
+    if bbox is None:
+        bbox = [0, 0, 0, 0]
+    hasstates = 1 if cells.states is not None else 0
+    f.write(HEADER.pack(MAGIC, VERSION, len(rule), hasstates, len(cells), *bbox))
+    f.write(rule + bytes(-len(rule) % 8))
+    data = cells.data
+    if sys.byteorder != 'little':
+        data = array('q', data)
+        data.byteswap()
+    f.write(memoryview(data).cast('B'))
+    if hasstates:
+        f.write(memoryview(cells.states).cast('B'))
+def readcellfile(buffer):
+    '''Reads a binary pattern from a bytes-like object, returning the rule, the CellSet and the bounding box.
+On little-endian machines the CellSet uses the buffer directly rather than copying it.'''
+    view = memoryview(buffer).cast('B')
+    if len(view) < HEADER.size:
+        raise ValueError('Binary pattern is too short to hold a header.')
+    magic, version, rulelength, hasstates, count, x, y, dx, dy = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError('Not a binary pattern file.')
+    if version != VERSION:
+        raise ValueError('Only the following binary pattern versions are supported: '+str([VERSION]))
+    rule = bytes(view[HEADER.size:HEADER.size + rulelength]).decode('utf-8')
+    start = HEADER.size + rulelength + (-rulelength % 8)
+    end = start + 8 * count
+    if len(view) < end + hasstates * count:
+        raise ValueError('Binary pattern is truncated.')
+    keys = view[start:end].cast('q')
+    states = None
+    if hasstates:
+        states = view[end:end + count]
+    if sys.byteorder != 'little':
+        keys = array('q', keys)
+        keys.byteswap()
+    bbox = None
+    if count > 0:
+        bbox = [x, y, dx, dy]
+    return rule, CellSet.fromkeys(keys, states), bbox
+def mapcellfile(filename):
+    '''Memory-maps a binary pattern file read-only and reads it with readcellfile.
+Processes that map the same file share its pages through the operating system.'''
+    with open(filename, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            raise ValueError('Binary pattern is too short to hold a header.')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return readcellfile(mapped)
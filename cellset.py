@@ -0,0 +1,205 @@
+'''A compact, array-backed set of cells for patterns with very large populations.'''
+from array import array
+from bisect import bisect_left
+#Cells are packed into one signed 64-bit key each, row by row:
+#key = (y + BIAS) * 2**32 + (x + BIAS), so sorting keys sorts cells by y, then x.
+BIAS = 2**30
+LOWMASK = 2**32 - 1
+def checkrange(xmin, xmax, ymin, ymax):
+    '''Raises a ValueError unless the given coordinate ranges fit in packed keys.'''
+    if xmin < -BIAS or ymin < -BIAS or xmax >= BIAS or ymax >= BIAS:
+        raise ValueError('CellSet coordinates must lie in the range [-2**30, 2**30).')
+def inrange(x, y):
+    '''Whether a cell fits in a packed key.'''
+    return -BIAS <= x < BIAS and -BIAS <= y < BIAS
+def packcell(x, y):
+    '''Packs a cell into a row-major 64-bit key, raising a ValueError if it does not fit.'''
+    if not inrange(x, y):
+        checkrange(x, x, y, y)
+    return ((y + BIAS) << 32) | (x + BIAS)
+def unpackcell(key):
+    '''Unpacks a row-major 64-bit key into a cell.'''
+    return ((key & LOWMASK) - BIAS, (key >> 32) - BIAS)
+class CellSet:
+    '''An immutable set of cells stored as a sorted array of packed keys.
+Behaves like a read-only grid dictionary mapping each live cell to 1.
+Cells of multi-state rules keep their states in a parallel array of bytes, and map to those instead.
+Coordinates must lie in the range [-2**30, 2**30), and a ValueError is raised for cells outside it.'''
+    __slots__ = ('data', 'states')
+    def __init__(self, cells=()):
+        if isinstance(cells, CellSet):
+            self.data = cells.data
+            self.states = cells.states
+            return
+        self.states = None
+        if not isinstance(cells, dict):
+            cells = set(cells)
+        if len(cells) > 0:
+            checkrange(min(x for x, y in cells), max(x for x, y in cells), min(y for x, y in cells), max(y for x, y in cells))
+        if isinstance(cells, dict):
+            keyed = sorted((((y + BIAS) << 32) | (x + BIAS), cells[(x, y)]) for x, y in cells if cells[(x, y)] != 0)
+            self.data = array('q', [x[0] for x in keyed])
+            if any(x[1] != 1 for x in keyed):
+                self.states = array('B', [x[1] for x in keyed])
+            return
+        self.data = array('q', sorted([((y + BIAS) << 32) | (x + BIAS) for x, y in cells]))
+    @classmethod
+    def fromkeys(cls, keys, states=None):
+        '''Creates a CellSet from packed keys that are already sorted and unique, and optionally their states.
+Arrays and memoryviews are used directly, without copying.'''
+        cellset = cls.__new__(cls)
+        cellset.data = keys if isinstance(keys, (array, memoryview)) else array('q', keys)
+        if states is not None and not isinstance(states, (array, memoryview)):
+            states = array('B', states)
+        cellset.states = states
+        return cellset
+    @classmethod
+    def fromrows(cls, rows):
+        '''Creates a CellSet from rows (y, [x, ...]) or (y, [x, ...], [state, ...]) given in row-major order, without sorting.'''
+        keys = array('q')
+        states = array('B')
+        for row in rows:
+            if len(row[1]) > 0:
+                checkrange(min(row[1]), max(row[1]), row[0], row[0])
+            high = (row[0] + BIAS) << 32
+            keys.extend([high | (x + BIAS) for x in row[1]])
+            if len(row) > 2:
+                states.extend(row[2])
+        if len(states) == 0 or all(x == 1 for x in states):
+            states = None
+        return cls.fromkeys(keys, states)
+    def rows(self):
+        '''Yields the cells as rows (y, [x, ...]) in row-major order, or (y, [x, ...], [state, ...]) if they have states.'''
+        data = self.data
+        states = self.states
+        start = 0
+        while start < len(data):
+            high = data[start] >> 32
+            end = bisect_left(data, (high + 1) << 32, start)
+            xs = [(key & LOWMASK) - BIAS for key in data[start:end]]
+            if states is None:
+                yield (high - BIAS, xs)
+            else:
+                yield (high - BIAS, xs, list(states[start:end]))
+            start = end
+    def __reduce__(self):
+        '''Pickles the keys as an array, copying them out of a memory-mapped file if necessary.'''
+        if self.states is None:
+            return (CellSet.fromkeys, (array('q', self.data),))
+        return (CellSet.fromkeys, (array('q', self.data), array('B', self.states)))
+    def __len__(self):
+        return len(self.data)
+    def __iter__(self):
+        for key in self.data:
+            yield ((key & LOWMASK) - BIAS, (key >> 32) - BIAS)
+    def __contains__(self, cell):
+        data = self.data
+        if not inrange(cell[0], cell[1]):
+            return False
+        key = packcell(cell[0], cell[1])
+        index = bisect_left(data, key)
+        return index < len(data) and data[index] == key
+    def get(self, cell, default=None):
+        '''Returns the state of a live cell (1 unless the set has states), or the default.'''
+        data = self.data
+        if not inrange(cell[0], cell[1]):
+            return default
+        key = packcell(cell[0], cell[1])
+        index = bisect_left(data, key)
+        if index < len(data) and data[index] == key:
+            return 1 if self.states is None else self.states[index]
+        return default
+    def __getitem__(self, cell):
+        state = self.get(cell)
+        if state is None:
+            raise KeyError(cell)
+        return state
+    def __eq__(self, other):
+        if isinstance(other, CellSet):
+            return self.data == other.data and list(self.values()) == list(other.values())
+        return NotImplemented
+    def __repr__(self):
+        return 'CellSet(' + str(list(self)) + ')'
+    def keys(self):
+        '''Iterates over the live cells.'''
+        return iter(self)
+    def values(self):
+        '''Iterates over the states of the live cells, which are all 1 for two-state sets.'''
+        if self.states is None:
+            return iter([1] * len(self.data))
+        return iter(self.states)
+    def items(self):
+        '''Iterates over (cell, state) pairs.'''
+        return zip(self, self.values())
+    def setop(self, other, operation):
+        '''Applies a set operation to two sets that may have states, keeping the state from this set where both have a cell.'''
+        mine = dict(zip(self.data, self.values()))
+        theirs = dict(zip(other.data, other.values()))
+        keys = sorted(getattr(set(mine), operation)(theirs))
+        if self.states is None and other.states is None:
+            return CellSet.fromkeys(keys)
+        return CellSet.fromkeys(keys, [mine[x] if x in mine else theirs[x] for x in keys])
+    def union(self, other):
+        '''Returns the cells in either set.'''
+        if self.states is not None or other.states is not None:
+            return self.setop(other, 'union')
+        return CellSet.fromkeys(sorted(set(self.data).union(other.data)))
+    def difference(self, other):
+        '''Returns the cells in this set but not the other.'''
+        if self.states is not None or other.states is not None:
+            return self.setop(other, 'difference')
+        return CellSet.fromkeys(sorted(set(self.data).difference(other.data)))
+    def symmetric_difference(self, other):
+        '''Returns the cells in exactly one of the sets.'''
+        if self.states is not None or other.states is not None:
+            return self.setop(other, 'symmetric_difference')
+        return CellSet.fromkeys(sorted(set(self.data).symmetric_difference(other.data)))
+    def intersection(self, other):
+        '''Returns the cells in both sets.'''
+        if self.states is not None or other.states is not None:
+            return self.setop(other, 'intersection')
+        return CellSet.fromkeys(sorted(set(self.data).intersection(other.data)))
+    def translate(self, dx, dy):
+        '''Returns the set moved by (dx, dy). Translation keeps the keys, and so the states, in order.'''
+        bbox = self.bbox
+        if bbox is not None:
+            checkrange(bbox[0] + dx, bbox[0] + bbox[2] - 1 + dx, bbox[1] + dy, bbox[1] + bbox[3] - 1 + dy)
+        offset = (dy << 32) + dx
+        return CellSet.fromkeys(array('q', [key + offset for key in self.data]), self.states)
+    def transform(self, transformation):
+        '''Returns the set transformed relative to the origin, as in gridops.transformgrid.'''
+        formulas = {
+            'flip_x': lambda x, y: (-x, y),
+            'flip_y': lambda x, y: (x, -y),
+            'identity': lambda x, y: (x, y),
+            'rot_90': lambda x, y: (-y, x),
+            'rot_180': lambda x, y: (-x, -y),
+            'rot_270': lambda x, y: (y, -x),
+            'flip_xy': lambda x, y: (-x, -y),
+            'rcw': lambda x, y: (-y, x),
+            'rccw': lambda x, y: (y, -x)
+            }
+        if transformation not in formulas:
+            raise ValueError('Only the following transformations are supported: '+str(list(formulas)))
+        formula = formulas[transformation]
+        if self.states is not None:
+            return CellSet({formula(x, y): state for (x, y), state in self.items()})
+        return CellSet(formula(x, y) for x, y in self)
+    @property
+    def bbox(self):
+        '''The bounding box of the set in the form [x, y, dx, dy], or None if empty.'''
+        data = self.data
+        if len(data) == 0:
+            return None
+        y = (data[0] >> 32) - BIAS
+        dy = (data[-1] >> 32) - BIAS - y + 1
+        lows = [key & LOWMASK for key in data]
+        x = min(lows) - BIAS
+        dx = max(lows) - BIAS - x + 1
+        return [x, y, dx, dy]
+    @property
+    def firstcell(self):
+        '''The leftmost cell of the top row, as in gridops.firstcell.'''
+        if len(self.data) == 0:
+            return None
+        return unpackcell(self.data[0])
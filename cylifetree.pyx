@@ -1,9 +1,9 @@
 '''The code for the lifetree and Pattern classes, which are the highest level components.'''
 #Importing modules:
-import copy
 import math
-import urllib.request
-import hashlib
+import io
+import multiprocessing
+import os
 #Other project modules:
 try:
     from .hensel import RuleHandler
@@ -13,280 +13,583 @@ try:
     from .cygridops import *
 except ImportError:
     from cygridops import *
+try:
+    from .cellset import CellSet
+except ImportError:
+    from cellset import CellSet
+try:
+    from .rle import readrle, writerle
+except ImportError:
+    from rle import readrle, writerle
+try:
+    from .cellfile import EXTENSION, iscellfile, writecellfile, readcellfile, mapcellfile
+except ImportError:
+    from cellfile import EXTENSION, iscellfile, writecellfile, readcellfile, mapcellfile
+try:
+    from .macrocell import ismacrocell, readmacrocell, writemacrocell
+except ImportError:
+    from macrocell import ismacrocell, readmacrocell, writemacrocell
+try:
+    from .hashlife import HashlifeEngine
+except ImportError:
+    from hashlife import HashlifeEngine
+try:
+    from .numpylife import NumpyEngine, np
+except ImportError:
+    from numpylife import NumpyEngine, np
+try:
+    from .apgcache import ApgcodeCache
+except ImportError:
+    from apgcache import ApgcodeCache
+try:
+    from .catagolue import CatagolueClient
+except ImportError:
+    from catagolue import CatagolueClient
 #A few global variables:
-cdef char *CATAGOLUE_URL = 'https://catagolue.hatsya.com'
+#Set the CATAGOLUE_URL environment variable to use a local stand-in for offline runs:
+CATAGOLUE_URL = os.environ.get('CATAGOLUE_URL', 'https://catagolue.hatsya.com')
+ENGINES = ['python', 'hashlife', 'numpy', 'incremental']
 class Lifetree:
     '''Handles and simulates patterns.'''
-    def __init__(self, rule='b3s23'):
+    def __init__(self, rule='b3s23', engine='python'):
         self.rulehandler = RuleHandler()
-        self.rule = self.rulehandler.canoniserule(rule)
-        self.conditionset = self.rulehandler.makeconditionset(self.rule)
+        #The transition table is compiled once per rule string and shared by every engine:
+        self.rule, self.table, self.states = self.rulehandler.compilerule(rule)
+        self.conditionset = {x for x in range(512) if self.table[x]}
+        #Which 9-bit neighbourhoods change the state of their centre cell (bit 4):
+        self.fliptable = bytes([self.table[x] ^ (x >> 4 & 1) for x in range(512)])
+        if engine not in ENGINES:
+            raise ValueError('Only the following engines are supported: '+str(ENGINES))
+        self.engine = engine
+        self.apgcache = ApgcodeCache(self.rule)
+        self.catagolue = CatagolueClient()
+        if engine == 'hashlife':
+            if self.states > 2:
+                raise ValueError('Generations rules are not supported by the hashlife engine.')
+            self.hashlife = HashlifeEngine(self.table)
+        if engine == 'numpy':
+            self.numpy = NumpyEngine(self.table, self.states)
     def getneighbours(self, grid):
         '''For each cell with at least one live neighbour, get a 9-bit integer.'''
+        #A cell adds its own bit to each neighbour, from where it sits relative to that neighbour:
+        offsets = [(a - 1, b - 1, 2**(8 - 3 * b - a)) for b in range(3) for a in range(3)]
         neighbours = {}
+        get = neighbours.get
         for x in grid:
             xcor, ycor = x[0], x[1]
-            for a in range(3):
-                for b in range(3):
-                    coord = (xcor + a - 1, ycor + b - 1)
-                    if coord not in neighbours:
-                        neighbours[coord] = 0
-                    neighbours[coord] += 2**(8 - 3 * b - a)
+            for a, b, bit in offsets:
+                coord = (xcor + a, ycor + b)
+                neighbours[coord] = get(coord, 0) + bit
         return neighbours
     def advanceone(self, grid):
         '''Advance a grid of cells by one generation.'''
+        if self.states > 2:
+            return self.advancegenerations(grid)
         neighbours = self.getneighbours(grid)
+        table = self.table
         newgrid = {}
         for x in neighbours:
-            if neighbours[x] in self.conditionset:
+            if table[neighbours[x]]:
                 newgrid[x] = 1
         return newgrid
-    def advance(self, grid, gens):
-        '''Advance a grid a specific number of generations.'''
+    def advancegenerations(self, grid):
+        '''Advance a grid of cells in a Generations rule by one generation.
+Only cells in state 1 count as neighbours, and cells in higher states decay until they reach state 0.'''
+        states = self.states
+        table = self.table
+        neighbours = self.getneighbours([x for x in grid if grid[x] == 1])
+        newgrid = {}
+        for x in grid:
+            state = grid[x]
+            if state != 0 and state + 1 < states:
+                newgrid[x] = state + 1
+        for x in neighbours:
+            if table[neighbours[x]] and grid.get(x, 0) <= 1:
+                newgrid[x] = 1
+        return newgrid
+    def advancechanged(self, grid, changed, previous=None):
+        '''Advance a grid by one generation in place, only re-evaluating cells next to changed cells.
+changed holds the cells that changed in the last generation (None to evaluate every cell),
+and previous those that changed in the generation before (None if unknown).
+Cells whose neighbourhoods are the same as two generations ago repeat what they did last generation without being evaluated,
+so still lifes cost nothing and period 2 oscillators one toggle per changing cell.
+Returns the cells that changed.'''
+        if self.states > 2:
+            return self.advancechangedgenerations(grid, changed)
+        if changed is None:
+            unsettled = grid
+        elif previous is None:
+            #Cells away from the changed cells keep their state:
+            unsettled = changed
+            repeated = []
+        else:
+            #Cells that changed in only one of the last two generations differ from two generations ago:
+            unsettled = set(changed).symmetric_difference(previous)
+            repeated = changed
+        fliptable = self.fliptable
+        if changed is None or len(unsettled) * 3 > len(grid):
+            #Most of the pattern is active, so evaluate every neighbourhood at once, as in advanceone:
+            neighbours = self.getneighbours(grid)
+            flipped = [x for x in neighbours if fliptable[neighbours[x]]]
+        else:
+            candidates = set()
+            update = candidates.update
+            for x, y in unsettled:
+                update(((x - 1, y - 1), (x, y - 1), (x + 1, y - 1), (x - 1, y), (x, y), (x + 1, y),
+                        (x - 1, y + 1), (x, y + 1), (x + 1, y + 1)))
+            flipped = [x for x in repeated if x not in candidates]
+            for coord in candidates:
+                x, y = coord
+                #The bits of the neighbourhood are laid out as in getneighbours:
+                code = (((x - 1, y - 1) in grid) | ((x, y - 1) in grid) << 1 | ((x + 1, y - 1) in grid) << 2
+                        | ((x - 1, y) in grid) << 3 | ((x, y) in grid) << 4 | ((x + 1, y) in grid) << 5
+                        | ((x - 1, y + 1) in grid) << 6 | ((x, y + 1) in grid) << 7 | ((x + 1, y + 1) in grid) << 8)
+                #Empty neighbourhoods never change, as in advanceone:
+                if fliptable[code]:
+                    flipped.append(coord)
+        for coord in flipped:
+            if coord in grid:
+                del grid[coord]
+            else:
+                grid[coord] = 1
+        return flipped
+    def advancechangedgenerations(self, grid, changed):
+        '''Advance a grid in a Generations rule by one generation in place, as in advancechanged.
+Cells in higher states always change, so they are always among the changed cells.'''
+        states = self.states
+        table = self.table
+        candidates = set()
+        for xcor, ycor in (grid if changed is None else changed):
+            for a in range(-1, 2):
+                for b in range(-1, 2):
+                    candidates.add((xcor + a, ycor + b))
+        offsets = [(a - 1, b - 1, 2**(3 * b + a)) for b in range(3) for a in range(3)]
+        updates = []
+        for coord in candidates:
+            xcor, ycor = coord
+            state = grid.get(coord, 0)
+            if state > 1:
+                newstate = (state + 1) % states
+            else:
+                code = 0
+                for dx, dy, bit in offsets:
+                    if grid.get((xcor + dx, ycor + dy)) == 1:
+                        code += bit
+                if code != 0 and table[code] == 1:
+                    newstate = 1
+                else:
+                    newstate = 2 if state == 1 else 0
+            if newstate != state:
+                updates.append((coord, newstate))
+        for coord, newstate in updates:
+            if newstate == 0:
+                del grid[coord]
+            else:
+                grid[coord] = newstate
+        return [x[0] for x in updates]
+    def splitgroup(self, grid, pieces, gens, maxtries=256):
+        '''Splits a group of cells, given as a list of pieces, into the smallest parts that evolve independently for gens generations.
+Connected unions of pieces are tried smallest first, and a part is split off when it and the rest of the group
+both evolve on their own exactly as they do together. Returns a list of lists of cells.
+The group is kept whole if no split is found within maxtries attempts.'''
+        if len(pieces) == 1:
+            return [pieces[0]]
+        touching = touchinggroups(pieces)
+        everything = frozenset(range(len(pieces)))
+        layer = [frozenset([0])]
+        seen = set(layer)
+        tries = 0
+        while layer and tries < maxtries:
+            nextlayer = []
+            for part in layer:
+                rest = everything - part
+                if len(rest) > 0 and tries < maxtries:
+                    tries += 1
+                    partcells = [cell for n in part for cell in pieces[n]]
+                    restcells = [cell for n in rest for cell in pieces[n]]
+                    group = {cell: grid[cell] for cell in partcells + restcells}
+                    if len(self.findinteractions(group, [partcells, restcells], gens)) == 0:
+                        return (self.splitgroup(grid, [pieces[n] for n in sorted(part)], gens, maxtries) +
+                                self.splitgroup(grid, [pieces[n] for n in sorted(rest)], gens, maxtries))
+                #Grow the part by one touching piece at a time, so it stays connected:
+                for n in part:
+                    for m in touching[n]:
+                        larger = part | {m}
+                        if m not in part and larger not in seen:
+                            seen.add(larger)
+                            nextlayer.append(larger)
+            layer = nextlayer
+        return [[cell for piece in pieces for cell in piece]]
+    def findinteractions(self, grid, groups, gens):
+        '''Checks whether groups of cells that partition a grid evolve independently for gens generations.
+The groups are simulated together in one batch, spaced far enough apart that they cannot interact,
+and compared with the whole grid generation by generation.
+Returns the indices of the groups that evolve differently on their own, stopping at the first difference.'''
+        bbox = getbbox(grid)
+        #Cells travel at most one cell per generation, so this spacing keeps the groups apart:
+        stride = bbox[2] + 2 * gens + 6
+        offset = bbox[0] - gens - 3
+        whole = dict(grid)
+        apart = {}
+        covered = {}
+        for n, group in enumerate(groups):
+            for x, y in group:
+                apart[(x + n * stride, y)] = grid[(x, y)]
+                covered[(x, y)] = n
+        wholechanged = None
+        apartchanged = None
+        wholeprevious = None
+        apartprevious = None
+        nearby = [(x, y) for y in range(-2, 3) for x in range(-2, 3)]
+        for _ in range(gens):
+            wholechanged, wholeprevious = self.advancechanged(whole, wholechanged, wholeprevious), wholechanged
+            apartchanged, apartprevious = self.advancechanged(apart, apartchanged, apartprevious), apartchanged
+            failed = set()
+            tocheck = dict.fromkeys(wholechanged)
+            #Move the changed cells of each group back to where they belong in the whole grid:
+            for cell in apartchanged:
+                n = (cell[0] - offset) // stride
+                original = (cell[0] - n * stride, cell[1])
+                tocheck[original] = n
+                if cell in apart:
+                    if covered.get(original, n) != n:
+                        #Two groups produced the same cell:
+                        failed.update((n, covered[original]))
+                    covered[original] = n
+                elif covered.get(original) == n:
+                    del covered[original]
+            for cell, changedby in tocheck.items():
+                n = covered.get(cell)
+                state = 0 if n is None else apart.get((cell[0] + n * stride, cell[1]), 0)
+                if whole.get(cell, 0) == state:
+                    continue
+                if n is not None:
+                    failed.add(n)
+                elif changedby is not None:
+                    #The cell died in its group but not in the whole grid:
+                    failed.add(changedby)
+                else:
+                    #The cell only appears in the whole grid, so it comes from the groups around it:
+                    for dx, dy in nearby:
+                        m = covered.get((cell[0] + dx, cell[1] + dy))
+                        if m is not None:
+                            failed.add(m)
+            if failed:
+                return failed
+        return set()
+    def advance(self, grid, gens, observers=None, sample=1):
+        '''Advance a grid a specific number of generations.
+If a list of observers is given, each is called as observer(gen, grid) at the generations chosen by sample
+(see samplegens) and at the end, all within the one simulation.'''
+        if observers is not None:
+            for gen, grid in self.walk(grid, gens, sample):
+                for observer in observers:
+                    observer(gen, grid)
+            return grid
+        if self.engine == 'hashlife':
+            return self.hashlife.advance(grid, gens)
+        if self.engine == 'numpy':
+            return self.numpy.advance(grid, gens, self.advanceone)
+        if self.engine == 'incremental':
+            #Cells whose neighbourhoods did not change last generation keep their state:
+            grid = todict(grid)
+            changed = None
+            previous = None
+            for _ in range(gens):
+                changed, previous = self.advancechanged(grid, changed, previous), changed
+            return grid
         adv = self.advanceone
         for _ in range(gens):
             grid = adv(grid)
         return grid
+    def walk(self, grid, gens, sample=1):
+        '''Advances a grid gens generations, yielding (gen, grid) at the generations chosen by sample and at the end.
+Each engine leaps straight from one sampled generation to the next.
+The incremental engine changes the grid in place, so copy a yielded grid to keep it.'''
+        grid = cleanupgrid(grid)
+        previous = 0
+        changed = None
+        before = None
+        samples = samplegens(sample, gens)
+        if len(samples) == 0 or samples[-1] != gens:
+            samples.append(gens)
+        for gen in samples:
+            if self.engine == 'incremental':
+                #The cells changed in the last two generations are carried from one leap to the next:
+                if previous == 0:
+                    grid = todict(grid)
+                for _ in range(gen - previous):
+                    changed, before = self.advancechanged(grid, changed, before), changed
+            elif gen > previous:
+                grid = self.advance(grid, gen - previous)
+            previous = gen
+            yield gen, grid
+    def trace(self, grid, gens, sample=1, snapshots=False):
+        '''Advances a grid gens generations in one simulation, yielding a dictionary of statistics at each sampled generation:
+gen, population, bbox and digest, and the cells as a CellSet under snapshot if snapshots is True.'''
+        for gen, current in self.walk(grid, gens, sample):
+            stats = {'gen': gen, 'population': len(current), 'bbox': getbbox(current), 'digest': calcdigest(current)}
+            if snapshots:
+                stats['snapshot'] = CellSet(current)
+            yield stats
     def rle_to_grid(self, rle):
         '''Converts an RLE to a dictionary format.'''
-        cdef int x = 0
-        cdef int y = 0
         grid = {}
-        cdef int position = -1
-        cdef list digits = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
-        cstring = ''
-        isnum = False
-        while position + 1 < len(rle):
-            position += 1
-            if not isnum:
-                if rle[position] == '#' or rle[position] == 'x':
-                    while rle[position] != '\n' and position < len(rle) - 1:
-                        position += 1
-                    continue
-                if rle[position] in digits:
-                    isnum = True
-                    cstring = rle[position]
-                else:
-                    operator = rle[position]
-                    if operator == '\n':
-                        continue
-                    if cstring != '':
-                        try:
-                            integer = int(cstring)
-                        except ValueError:
-                            raise Warning('Invalid RLE format, defaulting to empty pattern...')
-                            return {}
-                    else:
-                        integer = 1
-                    if operator ==  'o':
-                        for n in range(integer):
-                            grid[(x+n, y)] = 1
-                        x += integer
-                    elif operator ==  'b':
-                        x += integer
-                    elif operator ==  '$':
-                        x = 0
-                        y += integer
-                    elif operator ==  '!':
-                        break
-                    cstring = ''
-            else:
-                if rle[position] not in digits:
-                    isnum = False
-                    position -= 1
-                else:
-                    if rle[position] != '\n':
-                        cstring += rle[position]
+        if self.states > 2:
+            for y, xs, states in readrle(rle, multistate=True):
+                grid.update(zip([(x, y) for x in xs], states))
+            return grid
+        for y, xs in readrle(rle):
+            grid.update(dict.fromkeys([(x, y) for x in xs], 1))
         return grid
     def grid_to_rle(self, grid, bbox):
         '''Converts a grid to the RLE of a pattern.'''
-        rows = {}
-        for x, y in grid:
-            if y not in rows:
-                rows[y] = []
-            rows[y].append(x)
-        for x in rows:
-            rows[x] = sorted(rows[x])
-        rows = dict(sorted(rows.items()))
-        rle = 'x = '+str(bbox[2])+', y = '+str(bbox[3])+', rule = '+self.rule.replace('b', 'B').replace('s', '/S')+'\n'
-        for x in range(bbox[1], bbox[1] + bbox[3]):
-            if x not in rows:
-                rle += '$'
-                continue
-            for y in range(bbox[0], bbox[0] + bbox[2]):
-                if y in rows[x]:
-                    rle += 'o'
-                else:
-                    rle += 'b'
-            rle += '$'
-        rle = rle[:-1]
-        rle += '!'
-        #Compress the RLE:
-        operators = ['o', 'b', '$']
-        for x in operators:
-            longestchain = 1
-            while rle.count(x * (longestchain+1)) > 0:
-                longestchain += 1
-            if longestchain >= 2:
-                for n in range(longestchain, 1, -1):
-                    rle = rle.replace(x * n, str(n)+x)
-        return rle
+        rle = []
+        self.write_rle(grid, bbox, rle.append)
+        return ''.join(rle)
+    def write_macrocell(self, grid, write):
+        '''Writes a grid as a macrocell pattern in pieces to a function such as file.write.'''
+        writemacrocell(grid, self.rulehandler.rlerule(self.rule), write, self.states > 2)
+    def write_rle(self, grid, bbox, write):
+        '''Writes the RLE of a grid in pieces to a function such as file.write.'''
+        multistate = self.states > 2
+        writerle(gridrows(grid, multistate), bbox, self.rulehandler.rlerule(self.rule), write, multistate=multistate)
+    def load(self, source, compact=False):
+        '''Reads an RLE from a filename, file object or iterable of strings in chunks, returning a Pattern.
+If compact is True, the cells are stored in a CellSet.
+Binary pattern files are memory-mapped instead, and always give a CellSet.
+Macrocell files are read a line at a time, expanding each distinct node once.'''
+        if isinstance(source, str):
+            if iscellfile(source):
+                return Pattern(self, self.checkbinary(mapcellfile(source)))
+            if ismacrocell(source):
+                with open(source, 'r', encoding='utf-8') as f:
+                    grid = readmacrocell(f)[1]
+                return Pattern(self, CellSet(grid) if compact else grid)
+            with open(source, 'r', encoding='utf-8') as f:
+                return self.load(f, compact)
+        if compact:
+            return Pattern(self, CellSet.fromrows(readrle(source, multistate=self.states > 2)))
+        return Pattern(self, self.rle_to_grid(source))
+    def checkbinary(self, contents):
+        '''Checks that a binary pattern read by readcellfile was saved for this rule, returning its cells.'''
+        rule, cells, _ = contents
+        if rule != self.rule:
+            raise ValueError('Pattern was saved for rule '+rule+', not '+self.rule+'.')
+        return cells
     def hashsoup(self, instring, sym):
         '''Generates a soup based on the instring, returning a Pattern.'''
         #I borrowed this function from apgsearch Py3 - see the repo (https://github.com/PKTwentyTwo/apgsearch-Py3) for the credits for this function.
-        if sym[0] in ['G', 'H'] and 'stdin' not in sym.lower() and len(sym) > 1:
-            sym = sym[0].replace('G', 'C').replace('H', 'D') + sym[1:]
-            #Adaptation to account for GPU symmetries.
+        #The bits of the hash are laid out with precomputed index maps (see gridops.soupmap).
         if 'stdin' not in sym.lower():
-            s = hashlib.sha256(instring.encode('utf-8')).digest()
-            thesoup = []
-            if sym in ['D2_x', 'D8_1', 'D8_4']:
-                d = 1
-            elif sym in ['D4_x1', 'D4_x4']:
-                d = 2
-            else:
-                d = 0
-            for j in range(32):
-                t = s[j]
-                for k in range(8):
-                    if sym in ['8x32']:
-                        x = k + 8*(j % 4)
-                        y = int(j / 4)
-                    elif sym in ['4x64']:  
-                        x = k + 8*(j % 8)
-                        y = int(j / 8)
-                    elif sym in ['2x128']:
-                        x = k + 8*(j % 16)
-                        y = int(j / 16)
-                    elif sym in ['1x256']:
-                        x = k + 8*(j % 32)
-                        y = int(j / 32)
-                    else:
-                        x = k + 8*(j % 2)
-                        y = int(j / 2)
-                    if (t & (1 << (7 - k))):
-                        if (d == 0) | (x >= y):
-                            thesoup.append(x)
-                            thesoup.append(y)
-                        elif sym in ['D4_x1']:
-                            thesoup.append(y)
-                            thesoup.append(-x)
-                        elif sym in ['D4_x4']:
-                            thesoup.append(y)
-                            thesoup.append(-x-1)
-                        if (sym in ['D4_x1']) & (x == y):
-                            thesoup.append(y)
-                            thesoup.append(-x)
-                        if (sym in ['D4_x4']) & (x == y):
-                            thesoup.append(y)
-                            thesoup.append(-x-1)
-            # Checks for diagonal symmetries:
-            if (d >= 1):
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(thesoup[x+1])
-                    thesoup.append(thesoup[x])
-                if d == 2:
-                    if sym == 'D4_x1':
-                        for x in range(0, len(thesoup), 2):
-                            thesoup.append(-thesoup[x+1])
-                            thesoup.append(-thesoup[x])
-                    else:
-                        for x in range(0, len(thesoup), 2):
-                            thesoup.append(-thesoup[x+1] - 1)
-                            thesoup.append(-thesoup[x] - 1)
-            # Checks for orthogonal x symmetry:
-            if sym in ['D2_+1', 'D4_+1', 'D4_+2']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(thesoup[x])
-                    thesoup.append(-thesoup[x+1])
-            elif sym in ['D2_+2', 'D4_+4']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(thesoup[x])
-                    thesoup.append(-thesoup[x+1] - 1)
-            # Checks for orthogonal y symmetry:
-            if sym in ['D4_+1']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(-thesoup[x])
-                    thesoup.append(thesoup[x+1])
-            elif sym in ['D4_+2', 'D4_+4']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(-thesoup[x] - 1)
-                    thesoup.append(thesoup[x+1])
-            # Checks for rotate2 symmetry:
-            if sym in ['C2_1', 'C4_1', 'D8_1']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(-thesoup[x])
-                    thesoup.append(-thesoup[x+1])
-            elif sym in ['C2_2']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(-thesoup[x])
-                    thesoup.append(-thesoup[x+1]-1)
-            elif sym in ['C2_4', 'C4_4', 'D8_4']:
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(-thesoup[x]-1)
-                    thesoup.append(-thesoup[x+1]-1)
-            # Checks for rotate4 symmetry:
-            if (sym in ['C4_1', 'D8_1']):
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(thesoup[x+1])
-                    thesoup.append(-thesoup[x])
-            elif (sym in ['C4_4', 'D8_4']):
-                for x in range(0, len(thesoup), 2):
-                    thesoup.append(thesoup[x+1])
-                    thesoup.append(-thesoup[x]-1)
-            thesoup2 = {}
-            for x in range(len(thesoup)//2):
-                thesoup2[(thesoup[2*x], thesoup[2*x+1])] = 1
-            return self.pattern(thesoup2)
-        else:
-            if instring.count('-') == 1:
-                rle = instring.split('-')[1]
-                return self.pattern(rle)
+            return self.pattern(next(soupgrids([instring], sym)))
+        if instring.count('-') == 1:
+            rle = instring.split('-')[1]
+            return self.pattern(rle)
         return self.pattern('b!')
+    def hashsoups(self, instrings, sym):
+        '''Generates the soups for many instrings at once, returning a list of Patterns.'''
+        if 'stdin' in sym.lower():
+            return [self.hashsoup(x, sym) for x in instrings]
+        return [self.pattern(grid) for grid in soupgrids(instrings, sym)]
     def download_synth(self, apgcode):
         '''Downloads a glider synthesis from Catagolue.'''
+        return self.bulk_download_synths([apgcode])[apgcode]
+    def bulk_download_synths(self, apgcodes):
+        '''Downloads glider syntheses for many apgcodes at once, returning a dictionary mapping each to an RLE or None.'''
         if self.rule != 'b3s23':
             raise ValueError('Can only download syntheses if configured for b3s23.')
-        c = urllib.request.urlopen(CATAGOLUE_URL+'/textsamples/'+apgcode+'/'+'b3s23/synthesis')
-        response = c.read().decode('utf-8')
-        if 'x' in response:
-            return response
-        return None
+        apgcodes = list(apgcodes)
+        responses = self.catagolue.fetchmany([CATAGOLUE_URL+'/textsamples/'+x+'/b3s23/synthesis' for x in apgcodes])
+        return {x: response if 'x' in response else None for x, response in zip(apgcodes, responses)}
     def download_soups(self, apgcode, sym='C1'):
         '''Returns a list of soups producing a target object.'''
-        c = urllib.request.urlopen(CATAGOLUE_URL + '/textsamples/' + apgcode + '/' + self.rule)
-        response = c.read().decode('utf-8')
-        soups = []
-        for x in response.split('\n'):
-            data = x.split('/')
-            if len(data) != 2:
-                continue
-            symmetry, seed = data[0], data[1]
-            if symmetry != sym:
-                continue
-            soups.append(self.hashsoup(seed, symmetry))
+        return self.bulk_download_soups([apgcode], sym, processes=1)[apgcode]
+    def bulk_download_soups(self, apgcodes, sym='C1', processes=None, chunksize=256):
+        '''Downloads the sample soups for many apgcodes at once, returning a dictionary mapping each to a list of soups.
+Pages are fetched concurrently by self.catagolue, and the soups are generated across a multiprocessing pool.'''
+        apgcodes = list(apgcodes)
+        responses = self.catagolue.fetchmany([CATAGOLUE_URL + '/textsamples/' + x + '/' + self.rule for x in apgcodes])
+        seeds = []
+        for apgcode, response in zip(apgcodes, responses):
+            for x in response.split('\n'):
+                data = x.split('/')
+                if len(data) != 2:
+                    continue
+                symmetry, seed = data[0], data[1]
+                if symmetry != sym:
+                    continue
+                seeds.append((apgcode, symmetry, seed))
+        if processes is None:
+            processes = os.cpu_count()
+        chunks = [(self.rule, [x[1:] for x in seeds[n:n + chunksize]]) for n in range(0, len(seeds), chunksize)]
+        if processes == 1 or len(chunks) <= 1:
+            results = [soupchunk(x) for x in chunks]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.map(soupchunk, chunks)
+        soups = {x: [] for x in apgcodes}
+        grids = [grid for result in results for grid in result]
+        for (apgcode, _, _), grid in zip(seeds, grids):
+            soups[apgcode].append(self.pattern(grid))
         return soups
     def pattern(self, data):
-        '''Creates a new Pattern given an RLE string.'''
+        '''Creates a new Pattern given an RLE string, apgcode, macrocell string, grid or binary pattern.'''
         datatype = identifytype(data)
         if datatype == 'rle':
             grid = self.rle_to_grid(data)
+        elif datatype == 'binary':
+            grid = self.checkbinary(readcellfile(data))
+        elif datatype == 'macrocell':
+            grid = readmacrocell(data)[1]
         elif datatype == 'apgcode':
             grid = apgcodetogrid(data)
         else:
             grid = data
         pt = Pattern(self, grid)
         return pt
+    def combine(self, patterns, operation='add'):
+        '''Combines many patterns with one operation (add, xor or sub) in a single pass, returning a Pattern.
+Moves and transformations of the patterns (e.g pt(10, 5)('rcw')) are applied as their cells are read,
+so no intermediate patterns are built. sub removes every later pattern from the first.'''
+        views = []
+        for pt in patterns:
+            if not isinstance(pt, Pattern):
+                raise TypeError('Can only perform logical operations with other instances of Pattern.')
+            views.append((pt.cells, pt.affine))
+        return self.pattern(combinegrids(views, operation))
+    def stabilise(self, grid, maxgens=10000):
+        '''Advances a grid until its population becomes periodic with a period dividing 12.
+The population is checked every generation, so the hashlife and numpy engines, which are built for long leaps,
+step with the python engine here rather than rebuilding their quadtree or array each generation.'''
+        populations = [len(grid)]
+        adv = self.advanceone
+        incremental = self.engine == 'incremental'
+        if incremental:
+            #The incremental engine keeps track of changed cells from one generation to the next:
+            grid = todict(grid)
+            changed = None
+            previous = None
+        for _ in range(maxgens):
+            if len(populations) >= 48 and populations[-36:] == populations[-48:-12]:
+                break
+            if incremental:
+                changed, previous = self.advancechanged(grid, changed, previous), changed
+            else:
+                grid = adv(grid)
+            populations.append(len(grid))
+        return grid
+    def census(self, prefix, sym='C1', soups=1000, processes=None, chunksize=100, maxgens=10000):
+        '''Runs soups prefix + '0' through prefix + str(soups - 1) and tallies the objects in the ash.'''
+        if processes is None:
+            processes = os.cpu_count()
+        chunks = [(self.rule, self.engine, prefix, sym, n, min(n + chunksize, soups), maxgens) for n in range(0, soups, chunksize)]
+        if processes == 1:
+            results = [censuschunk(x) for x in chunks]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.map(censuschunk, chunks)
+        tally = {}
+        for result in results:
+            for apgcode in result:
+                tally[apgcode] = tally.get(apgcode, 0) + result[apgcode]
+        return dict(sorted(tally.items(), key=lambda x: (-x[1], x[0])))
+def censuschunk(args):
+    '''Tallies the objects from a range of soups. Used by Lifetree.census.'''
+    rule, engine, prefix, sym, start, stop, maxgens = args
+    lifetree = Lifetree(rule, engine)
+    tally = {}
+    for soup in lifetree.hashsoups([prefix + str(n) for n in range(start, stop)], sym):
+        ash = lifetree.pattern(lifetree.stabilise(soup.grid, maxgens))
+        #Stabilised ash has a population period dividing 12:
+        for component in ash.separate(12):
+            apgcode = component.apgcode
+            tally[apgcode] = tally.get(apgcode, 0) + 1
+    return tally
+def soupchunk(args):
+    '''Generates the soups for a list of (symmetry, seed) pairs. Used by Lifetree.bulk_download_soups.'''
+    rule, seeds = args
+    lifetree = Lifetree(rule)
+    return [lifetree.hashsoup(seed, symmetry).grid for symmetry, seed in seeds]
+#The seed of a sweep, stored once in each worker process rather than sent with every chunk:
+SWEEPSEED = None
+def sweepinit(buffer):
+    '''Stores the seed of a sweep, given in the binary format. Used by Pattern.sweep.'''
+    global SWEEPSEED
+    SWEEPSEED = readcellfile(buffer)[1]
+def sweepchunk(args):
+    '''Runs the seed of a sweep under a list of rules. Used by Pattern.sweep.'''
+    rules, engine, gens, periodgens = args
+    initial = getbbox(SWEEPSEED)
+    results = {}
+    for rule in rules:
+        if initial is None:
+            #An empty seed stays empty under every rule, since B0 rules are not supported:
+            results[rule] = {'population': 0, 'bbox': None, 'growth': None, 'period': None, 'displacement': None}
+            continue
+        lifetree = Lifetree(rule, engine)
+        final = lifetree.pattern(lifetree.advance(SWEEPSEED, gens))
+        stats = {'population': final.population, 'bbox': final.bbox, 'growth': None,
+                 'period': None, 'displacement': None}
+        if final.bbox is not None:
+            stats['growth'] = (final.bbox[2] - initial[2], final.bbox[3] - initial[3])
+            try:
+                _, stats['period'], stats['displacement'] = final.periodicity(periodgens)
+            except ValueError:
+                #The pattern dies out or does not become periodic soon enough.
+                pass
+        results[rule] = stats
+    return results
+def samplegens(sample, gens):
+    '''Returns the sorted generations from 0 to gens chosen by a sampling spec:
+an integer k for every k generations, 'powers' for 0 and the powers of two, or a list of generations.'''
+    if isinstance(sample, int):
+        if sample < 1:
+            raise ValueError('Sampling interval must be at least 1.')
+        return list(range(0, gens + 1, sample))
+    if sample == 'powers':
+        return [0] + [2**n for n in range(gens.bit_length()) if 2**n <= gens]
+    if isinstance(sample, str):
+        raise ValueError('Only the following sampling specs are supported: an integer, a list of generations, '+str(['powers']))
+    return sorted({x for x in sample if 0 <= x <= gens})
 class Pattern:
     '''This is the class used for manipulation of patterns.'''
     def __init__(self, lifetree, grid=dict()):
         '''This method should only be called by a lifetree.'''
         self.lifetree = lifetree
         self.grid = grid
+    @property
+    def grid(self):
+        '''The live cells of a pattern, as a dictionary mapping coordinates to 1.'''
+        if self.affine is not None:
+            #Moves and transformations are only applied to the cells when they are needed:
+            cached = {'clean': True}
+            if 'population' in self.cached:
+                cached['population'] = self.cached['population']
+            if 'bbox' in self.cached:
+                cached['bbox'] = affinebbox(self.cached['bbox'], self.affine)
+            self.cells = affinegrid(self.cells, self.affine)
+            self.affine = None
+            self.cached = cached
+        return self.cells
+    @grid.setter
+    def grid(self, grid):
+        '''Replaces the cells of a pattern, forgetting anything found by oscar or cached about the old cells.'''
+        self.cells = grid
+        self.affine = None
+        self.oscarresult = None
+        #Properties of self.cells (before any pending move or transformation), computed when first needed:
+        self.cached = {}
     def __getitem__(self, gens):
         '''Advances a pattern a given number of generations.'''
         self2 = self.clone()
         self2.grid = self2.lifetree.advance(self.grid, gens)
+        if isinstance(self.grid, CellSet):
+            try:
+                self2.grid = CellSet(self2.grid)
+            except ValueError:
+                #Cells beyond the range of a CellSet stay in a plain grid:
+                pass
         return self2
     def __call__(self, *args):
         '''Translates or transforms a pattern.'''
@@ -323,17 +626,24 @@ class Pattern:
         '''Checks if two patterns are equal, including their location.'''
         if type(self) != type(other):
             return False
-        if self.digest != other.digest:
+        #Population and bounding box are cheaper to compare than the cells themselves:
+        if self.population != other.population:
             return False
-        if (self - other).population != 0:
+        if self.bbox != other.bbox:
             return False
-        if (other - self).population != 0:
-            return False
-        return True
+        return gridsequal(self.grid, other.grid)
     def transform(self, transformation):
         '''Transforms a pattern relative to the origin.'''
+        if transformation not in TRANSFORMATIONS:
+            raise ValueError('Only the following transformations are supported: '+str(list(TRANSFORMATIONS)))
+        return self.view(TRANSFORMATIONS[transformation] + (0, 0))
+    def view(self, affine):
+        '''Returns a pattern with an affine map (a, b, c, d, dx, dy) applied lazily to its cells.'''
         pt2 = self.clone()
-        pt2.grid = transformgrid(self.grid, transformation)
+        pt2.affine = composeaffine(self.affine or IDENTITY, affine)
+        if affine[:4] != IDENTITY[:4]:
+            #Rotated patterns may evolve differently under anisotropic rules:
+            pt2.oscarresult = None
         return pt2
     def centre(self):
         '''Moves a pattern so that the bounding box is centered on the origin.'''
@@ -342,153 +652,314 @@ class Pattern:
         dy = -math.floor((bbox[1] + bbox[3])/2)
         return self(dx, dy)
     def clone(self):
-        '''Creates a copy of a pattern.'''
-        thecopy = copy.deepcopy(self)
-        thecopy.cleanup()
+        '''Creates a copy of a pattern.
+Patterns are never modified in place, so the copy shares its cells and lifetree with the original.'''
+        thecopy = Pattern(self.lifetree, self.cells)
+        thecopy.affine = self.affine
+        thecopy.oscarresult = self.oscarresult
+        thecopy.cached = dict(self.cached)
         return thecopy
+    def __copy__(self):
+        '''Returns a copy of a pattern sharing the same cells.'''
+        return self.clone()
+    def __deepcopy__(self, memo):
+        '''Returns a copy of a pattern sharing the same cells and lifetree.'''
+        return self.clone()
+    def compact(self):
+        '''Returns a copy of a pattern that stores its cells in a CellSet, using far less memory per cell.'''
+        pt2 = self.clone()
+        pt2.grid = CellSet(self.grid)
+        return pt2
     def cleanup(self):
-        '''Cleans up the stored data of a pattern.'''
-        self.grid = cleanupgrid(self.grid)
+        '''Cleans up the stored data of a pattern, unless it is already known to be clean.'''
+        if not self.cached.get('clean'):
+            self.cells = cleanupgrid(self.cells)
+            self.cached['clean'] = True
     def move(self, dx, dy):
         '''Translates a pattern by (dx, dy).'''
-        self2 = self.clone()
-        self2.grid = shiftgrid(self.grid, dx, dy)
-        self2.cleanup()
-        return self2
+        return self.view((1, 0, 0, 1, dx, dy))
     def oscar(self, maxgens=1024):
         '''Finds the period of a pattern. Returns an error if it is aperiodic.'''
-        inithash = self.digest
-        pt = self.clone()[1]
-        gens = 1
-        while pt.digest != inithash:
-            pt = pt[1]
-            gens += 1
-            if gens > maxgens:
-                raise ValueError('Pattern does not become periodic within '+str(maxgens)+' generations.')
-                return -1
-        return gens
-    def save(self, filename = 'pattern.rle'):
-        '''Saves the RLE of a pattern in a file.'''
-        rle = self.rle
-        f = open(filename, 'w', encoding = 'utf-8')
-        f.write(rle)
-        f.close()
+        return self.periodicity(maxgens)[1]
+    def periodicity(self, maxgens=1024):
+        '''Finds the pre-period, period and displacement of a pattern that eventually becomes periodic.
+Returns an error if it does not become periodic within maxgens generations.'''
+        if self.oscarresult is not None:
+            return self.oscarresult
+        grid = todict(self.grid)
+        if len(grid) == 0:
+            raise ValueError('Cannot find the period of an empty pattern.')
+        #Only cells that change are re-evaluated and re-hashed each generation:
+        rolling = RollingDigest(grid)
+        seen = {rolling.digest: (0, rolling.origin)}
+        changed = None
+        previous = None
+        states = self.lifetree.states
+        for gens in range(1, maxgens + 1):
+            changed, previous = self.lifetree.advancechanged(grid, changed, previous), changed
+            for cell in changed:
+                #A cell that changed must have come from the previous state (state 0 follows the last state):
+                state = grid.get(cell, 0)
+                rolling.change(cell, (state - 1) % states, state)
+            if rolling.population == 0:
+                raise ValueError('Pattern dies out after '+str(gens)+' generations.')
+            digest = rolling.digest
+            if digest not in seen:
+                seen[digest] = (gens, rolling.origin)
+                continue
+            start, origin = seen[digest]
+            period = gens - start
+            displacement = (rolling.origin[0] - origin[0], rolling.origin[1] - origin[1])
+            #Confirm the match by running one more period:
+            later = dict(grid)
+            laterchanged = changed
+            laterprevious = previous
+            for _ in range(period):
+                laterchanged, laterprevious = self.lifetree.advancechanged(later, laterchanged, laterprevious), laterchanged
+            if later == {(x + displacement[0], y + displacement[1]): grid[(x, y)] for x, y in grid}:
+                self.oscarresult = (start, period, displacement)
+                return self.oscarresult
+        raise ValueError('Pattern does not become periodic within '+str(maxgens)+' generations.')
+    def sweep(self, rules, gens, processes=None, chunksize=16, periodgens=1024, engine=None):
+        '''Runs a pattern for gens generations under each of a list of rules, in parallel.
+Returns a dictionary mapping each canonical rule to the final population, bounding box and its growth,
+and the period and displacement of the final pattern (None if not found within periodgens generations).'''
+        if engine is None:
+            engine = self.lifetree.engine
+        if processes is None:
+            processes = os.cpu_count()
+        #Compile every rule before the workers start, so that forked workers inherit the tables:
+        rulehandler = self.lifetree.rulehandler
+        rules = [rulehandler.compilerule(x)[0] for x in rules]
+        #The seed is sent to each worker once, in the binary format:
+        buffer = self.binary
+        chunks = [(rules[n:n + chunksize], engine, gens, periodgens) for n in range(0, len(rules), chunksize)]
+        if processes == 1:
+            sweepinit(buffer)
+            results = [sweepchunk(x) for x in chunks]
+        else:
+            with multiprocessing.Pool(processes, sweepinit, (buffer,)) as pool:
+                results = pool.map(sweepchunk, chunks)
+        stats = {}
+        for result in results:
+            stats.update(result)
+        return stats
+    def trace(self, gens, sample=1, snapshots=False, arrays=False):
+        '''Runs a pattern gens generations in one simulation, recording statistics at the sampled generations.
+Yields a dictionary (gen, population, bbox, digest, and snapshot as a Pattern if snapshots is True) per sample,
+or if arrays is True returns a dictionary of NumPy arrays, with empty bounding boxes stored as zeros.'''
+        stream = self.lifetree.trace(self.grid, gens, sample, snapshots)
+        if not arrays:
+            return (self.tracestats(stats) for stats in stream)
+        if np is None:
+            raise ImportError('Trace arrays require NumPy to be installed.')
+        columns = {'gen': [], 'population': [], 'bbox': [], 'digest': []}
+        if snapshots:
+            columns['snapshot'] = []
+        for stats in stream:
+            stats = self.tracestats(stats)
+            if stats['bbox'] is None:
+                stats['bbox'] = [0, 0, 0, 0]
+            for key in columns:
+                columns[key].append(stats[key])
+        for key in ['gen', 'population', 'bbox', 'digest']:
+            columns[key] = np.array(columns[key], dtype=np.int64)
+        return columns
+    def tracestats(self, stats):
+        '''Turns a snapshot from Lifetree.trace into a Pattern.'''
+        if 'snapshot' in stats:
+            stats['snapshot'] = self.lifetree.pattern(stats['snapshot'])
+        return stats
+    def save(self, filename = 'pattern.rle', fileformat = None):
+        '''Saves a pattern in a file, as an RLE, a macrocell or in the binary format.
+The format is chosen from the file extension unless it is given.'''
+        if fileformat is None:
+            fileformat = 'rle'
+            if filename.endswith(EXTENSION):
+                fileformat = 'binary'
+            elif filename.endswith('.mc'):
+                fileformat = 'macrocell'
+        formats = ['rle', 'macrocell', 'binary']
+        if fileformat not in formats:
+            raise ValueError('Only the following file formats are supported: '+str(formats))
+        self.cleanup()
+        if fileformat == 'binary':
+            cells = self.grid
+            if not isinstance(cells, CellSet):
+                cells = CellSet(cells)
+            with open(filename, 'wb') as f:
+                writecellfile(f, cells, self.lifetree.rule)
+            return
+        if fileformat == 'macrocell':
+            with open(filename, 'w', encoding = 'utf-8') as f:
+                self.lifetree.write_macrocell(self.grid, f.write)
+            return
+        with open(filename, 'w', encoding = 'utf-8') as f:
+            self.lifetree.write_rle(self.grid, self.bbox, f.write)
+    @property
+    def binary(self):
+        '''The pattern in the binary format, as bytes.'''
+        cells = self.grid
+        if not isinstance(cells, CellSet):
+            cells = CellSet(cells)
+        f = io.BytesIO()
+        writecellfile(f, cells, self.lifetree.rule)
+        return f.getvalue()
+    @property
+    def macrocell(self):
+        '''The pattern in Golly's macrocell format.'''
+        lines = []
+        self.lifetree.write_macrocell(self.grid, lines.append)
+        return ''.join(lines)
     @property
     def rle(self):
         '''The Run Length Encoding (RLE) of a pattern.'''
         self.cleanup()
-        return self.lifetree.grid_to_rle(self.grid, self.bbox)
+        grid = self.grid
+        if 'rle' not in self.cached:
+            self.cached['rle'] = self.lifetree.grid_to_rle(grid, self.bbox)
+        return self.cached['rle']
     @property
     def population(self):
         '''How many live cells a pattern has.'''
-        self.cleanup()
-        return len(self.grid)
+        if 'population' not in self.cached:
+            self.cleanup()
+            self.cached['population'] = len(self.cells)
+        return self.cached['population']
     @property
     def coords(self):
         '''A list of every cell in a pattern.'''
         self.cleanup()
-        thecoords = []
-        for x in self.grid:
-            thecoords.append(x)
-        return thecoords
+        return list(self.grid)
     @property
     def firstcell(self):
         '''The first cell of a pattern.'''
-        self.grid = dict(sorted(self.grid.items()))
-        count = 0
-        for x in self.grid:
-            count += 1
-            if count == 1:
-                return x
-        return None
+        self.cleanup()
+        cells = self.grid
+        if 'firstcell' not in self.cached:
+            self.cached['firstcell'] = min(cells) if len(cells) > 0 else None
+        return self.cached['firstcell']
     @property
     def digest(self):
         '''A hash of the pattern (orientation dependent).'''
-        return calcdigest(self.grid)
+        #Digests do not depend on position, so a pending move can be ignored:
+        cells = self.cells
+        if self.affine is not None and self.affine[:4] != IDENTITY[:4]:
+            cells = self.grid
+        if 'digest' not in self.cached:
+            self.cached['digest'] = calcdigest(cells)
+        return self.cached['digest']
     @property
     def octodigest(self):
         '''A hash of the pattern (orientation independent).'''
-        return calcoctodigest(self.grid)
+        return calcoctodigest(self.cells)
+    @property
+    def preperiod(self):
+        '''How many generations a pattern takes to become periodic. Returns an error if aperiodic.'''
+        return self.cachedperiodicity()[0]
     @property
     def period(self):
         '''The period of a pattern. Returns an error if aperiodic.'''
-        return self.oscar()
+        return self.cachedperiodicity()[1]
     @property
     def displacement(self):
         '''The displacement of a periodic pattern in the form (dx, dy). Returns an error if aperiodic.'''
-        period = self.period
-        if self.population == 0:
-            raise ValueError('Cannot calculate displacement for an empty pattern.')
-        firstcella = self.firstcell
-        firstcellb = self[period].firstcell
-        displacement = (firstcellb[0] - firstcella[0], firstcellb[1] - firstcella[1])
-        return displacement
-        
+        return self.cachedperiodicity()[2]
+    def cachedperiodicity(self):
+        '''Returns the stored result of oscar if there is one, and otherwise looks in the lifetree's cache before running oscar.
+Results from either are stored, so the cache is only consulted once per pattern.'''
+        if self.oscarresult is None:
+            cache = self.lifetree.apgcache
+            self.usecached(cache.get(cache.key(self.grid)))
+        return self.periodicity()
+    def usecached(self, entry):
+        '''Stores a cached classification as the result of oscar, if it is known to be periodic from the start.'''
+        if entry is not None and entry[0] != 'aperiodic':
+            #Only patterns that are periodic from the start have an apgcode:
+            self.oscarresult = (0, entry[1], entry[2])
     @property
     def bbox(self):
         '''The bounding box of a pattern in the form [x, y, dx, dy].'''
-        cells = self.coords
-        if len(cells) == 0:
-            #Empty patterns do not have a proper bounding box.
-            return None
-        exes = [c[0] for c in cells]
-        whys = [c[1] for c in cells]
-
-        x = min(exes)
-        y = min(whys)
-        dx = max(exes) - x + 1
-        dy = max(whys) - y + 1
-        return [x, y, dx, dy]
+        if 'bbox' not in self.cached:
+            self.cleanup()
+            self.cached['bbox'] = getbbox(self.cells)
+        bbox = self.cached['bbox']
+        if self.affine is not None:
+            return affinebbox(bbox, self.affine)
+        return None if bbox is None else list(bbox)
     @property
     def components(self):
         '''A list of the connected islands in a pattern.'''
-        coords = self.coords
+        return self.islands()
+    def separate(self, gens=None):
+        '''Splits a pattern into objects that evolve independently, as apgsearch separates ash.
+Cells start in Moore islands, and only islands that interact are merged, until each group evolves by itself exactly
+as it does within the whole pattern for gens generations: by default one period, or 12 if the pattern is aperiodic.
+Each group is then split into its von Neumann islands wherever simulation shows the parts evolve independently,
+so a pseudo still life comes apart unless two of its constituents touch orthogonally.'''
+        if gens is None:
+            try:
+                gens = self.period
+            except ValueError:
+                gens = 12
+        grid = todict(self.grid)
+        groups = labelcomponents(grid, 'moore')
+        while len(groups) > 1:
+            failed = self.lifetree.findinteractions(grid, groups, gens)
+            if len(failed) == 0:
+                break
+            groups = mergegroups(groups, failed)
+        objects = []
+        for group in groups:
+            pieces = labelcomponents({x: grid[x] for x in group}, 'vonneumann')
+            objects.extend(self.lifetree.splitgroup(grid, pieces, gens))
+        return [self.lifetree.pattern({x: grid[x] for x in group}) for group in objects]
+    def islands(self, neighbourhood='moore'):
+        '''Splits a pattern into islands of cells connected through a neighbourhood: moore, vonneumann or distance2.'''
+        grid = self.grid
         islands = []
-        while len(coords) > 0:
-            coord = coords[0]
-            island = [coord]
-            coords.remove(coord)
-            chosencoord = 0
-            while chosencoord < len(island):
-                coord = island[chosencoord]
-                for dx in range(-1, 2):
-                    for dy in range(-1, 2):
-                        neighbour = (coord[0] + dx, coord[1] + dy)
-                        if neighbour in coords and neighbour not in islands:
-                            coords.remove(neighbour)
-                            island.append(neighbour)
-                chosencoord += 1
-            islands.append(island)
-
-        islands2 = []
-        for x in islands:
-            current_island = {}
-            for y in x:
-                current_island[y] = 1
-            islands2.append(self.lifetree.pattern(current_island))
-        return islands2
+        for island in labelcomponents(grid, neighbourhood):
+            islands.append(self.lifetree.pattern({x: grid[x] for x in island}))
+        return islands
     @property
     def apgcode(self):
         '''A unique identifier for periodic patterns.'''
+        return self.classify()[0]
+    def classify(self):
+        '''Returns the apgcode, period and displacement of a pattern, using the lifetree's cache.'''
+        cache = self.lifetree.apgcache
+        key = cache.key(self.grid)
+        entry = cache.get(key)
+        if entry is not None:
+            self.usecached(entry)
+            return entry
         try:
-            period = self.period
+            preperiod, period, displacement = self.periodicity()
         except:
-            return 'aperiodic'
+            cache.add(key, 'aperiodic', None, None)
+            return ('aperiodic', None, None)
+        if preperiod == 0:
+            apgcode = self.findapgcode(period, displacement)
+        else:
+            #Only patterns that are periodic from the start have an apgcode:
+            apgcode = 'aperiodic'
+        cache.add(key, apgcode, period, displacement)
+        return (apgcode, period, displacement)
+    def findapgcode(self, period, displacement):
+        '''Finds the apgcode of a pattern with a known period and displacement.'''
         pt = self.clone()
         gridphases = []
         for x in range(period):
             gridphases.append(pt.grid)
             pt = pt[1]
-        gridphases2 = []
-        for x in gridphases:
-            gridphases2 += getorientations(x)
         canonicalapgcode = 'Z'*10000
-        for x in gridphases2:
-            canonicalapgcode = compareapgcode(canonicalapgcode, getgridapgcode(x))
+        for x in gridphases:
+            for apgcode in getorientationcodes(x):
+                canonicalapgcode = compareapgcode(canonicalapgcode, apgcode)
         if period == 1:
             prefix = 'xs' + str(self.population) + '_'
         else:
-            if self.displacement != (0, 0):
+            if displacement != (0, 0):
                 prefix = 'xq' + str(period) + '_'
             else:
                 prefix = 'xp' + str(period) + '_'
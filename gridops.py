@@ -1,22 +1,61 @@
 '''Some operations for the grid storage method to save time.'''
 import hashlib
+import mmap
+import re
+try:
+    from .cellset import CellSet
+except ImportError:
+    from cellset import CellSet
 def cleanupgrid(grid):
     '''Removes all non-zero coordinates from the grid.'''
+    if isinstance(grid, CellSet):
+        #A CellSet only ever holds live cells.
+        return grid
     newgrid = {}
     for x in grid:
         if grid[x] != 0:
-            newgrid[x] = 1
+            #Multi-state rules store the state of each cell:
+            newgrid[x] = grid[x]
     return newgrid
+def todict(grid):
+    '''Returns a new dictionary of the live cells in a grid, which can be modified in place.'''
+    if isinstance(grid, CellSet):
+        if grid.states is None:
+            return dict.fromkeys(grid, 1)
+        return dict(grid.items())
+    return cleanupgrid(grid)
 def shiftgrid(grid, dx, dy):
     '''Translate a grid by a given quantity.'''
+    if isinstance(grid, CellSet):
+        return grid.translate(dx, dy)
     grid = cleanupgrid(grid)
     newgrid = {}
     for x, y in grid:
         if grid[(x, y)] != 0:
-            newgrid[(x + dx, y + dy)] = 1
+            newgrid[(x + dx, y + dy)] = grid[(x, y)]
     return newgrid
+def gridrows(grid, states=False):
+    '''Yields the live cells of a grid as rows (y, [x, ...]), sorted by y and then x.
+If states is True, rows are (y, [x, ...], [state, ...]) instead.'''
+    if isinstance(grid, CellSet) and (grid.states is None or states):
+        yield from grid.rows()
+        return
+    grid = cleanupgrid(grid)
+    rows = {}
+    for x, y in grid:
+        if y not in rows:
+            rows[y] = []
+        rows[y].append(x)
+    for y in sorted(rows):
+        xs = sorted(rows[y])
+        if states:
+            yield (y, xs, [grid[(x, y)] for x in xs])
+        else:
+            yield (y, xs)
 def firstcell(grid):
     '''Find the first cell in a grid.'''
+    if isinstance(grid, CellSet):
+        return grid.firstcell
     whys = [coord[1] for coord in grid]
     topcoord = min(whys)
     exes =  [coord[0] for coord in grid if coord[1] == topcoord]
@@ -24,32 +63,76 @@ def firstcell(grid):
     return (leftcoord, topcoord)
 def transformgrid(grid, transformation):
     '''Apply a transformation to a grid.'''
+    if isinstance(grid, CellSet):
+        return grid.transform(transformation)
     grid = cleanupgrid(grid)
     newgrid = {}
     transformations=['flip_x','flip_y','identity','rot_90','rot_180','rot_270','flip_xy','rcw','rccw']
     if transformation not in transformations:
         raise ValueError('Only the following transformations are supported: '+str(transformations))
     if transformation ==  'flip_x':
-        newgrid = {(-x, y):1 for x, y in grid}
+        newgrid = {(-x, y):grid[(x, y)] for x, y in grid}
     elif transformation ==  'flip_y':
-        newgrid = {(x, -y):1 for x, y in grid}
+        newgrid = {(x, -y):grid[(x, y)] for x, y in grid}
     elif transformation ==  'identity':
-        newgrid = {(x, y):1 for x, y in grid}
+        newgrid = {(x, y):grid[(x, y)] for x, y in grid}
     elif transformation ==  'rot_90':
-        newgrid = {(-y, x):1 for x, y in grid}
+        newgrid = {(-y, x):grid[(x, y)] for x, y in grid}
     elif transformation ==  'rot_180':
-        newgrid = {(-x, -y):1 for x, y in grid}
+        newgrid = {(-x, -y):grid[(x, y)] for x, y in grid}
     elif transformation ==  'rot_270':
-        newgrid = {(y, -x):1 for x, y in grid}
+        newgrid = {(y, -x):grid[(x, y)] for x, y in grid}
     elif transformation ==  'flip_xy':
-        newgrid = {(-x, -y):1 for x, y in grid}
+        newgrid = {(-x, -y):grid[(x, y)] for x, y in grid}
     elif transformation ==  'rcw':
-        newgrid = {(-y, x):1 for x, y in grid}
+        newgrid = {(-y, x):grid[(x, y)] for x, y in grid}
     elif transformation ==  'rccw':
-        newgrid = {(y, -x):1 for x, y in grid}
+        newgrid = {(y, -x):grid[(x, y)] for x, y in grid}
     return newgrid
+#Each transformation as a matrix (a, b, c, d), mapping (x, y) to (a*x + b*y, c*x + d*y):
+TRANSFORMATIONS = {
+    'flip_x': (-1, 0, 0, 1),
+    'flip_y': (1, 0, 0, -1),
+    'identity': (1, 0, 0, 1),
+    'rot_90': (0, -1, 1, 0),
+    'rot_180': (-1, 0, 0, -1),
+    'rot_270': (0, 1, -1, 0),
+    'flip_xy': (-1, 0, 0, -1),
+    'rcw': (0, -1, 1, 0),
+    'rccw': (0, 1, -1, 0)
+    }
+#An affine map (a, b, c, d, dx, dy) applies a matrix, then translates by (dx, dy):
+IDENTITY = (1, 0, 0, 1, 0, 0)
+def composeaffine(first, second):
+    '''Returns the affine map that applies first, then second.'''
+    a1, b1, c1, d1, x1, y1 = first
+    a2, b2, c2, d2, x2, y2 = second
+    return (a2 * a1 + b2 * c1, a2 * b1 + b2 * d1, c2 * a1 + d2 * c1, c2 * b1 + d2 * d1,
+            a2 * x1 + b2 * y1 + x2, c2 * x1 + d2 * y1 + y2)
+def affinegrid(grid, affine):
+    '''Applies an affine map to a grid.'''
+    a, b, c, d, dx, dy = affine
+    if (a, b, c, d) == (1, 0, 0, 1):
+        return shiftgrid(grid, dx, dy)
+    if isinstance(grid, CellSet):
+        if grid.states is not None:
+            return CellSet({(a * x + b * y + dx, c * x + d * y + dy):state for (x, y), state in grid.items()})
+        return CellSet((a * x + b * y + dx, c * x + d * y + dy) for x, y in grid)
+    grid = cleanupgrid(grid)
+    return {(a * x + b * y + dx, c * x + d * y + dy):grid[(x, y)] for x, y in grid}
+def affinebbox(bbox, affine):
+    '''Applies an affine map to a bounding box in the form [x, y, dx, dy].'''
+    if bbox is None:
+        return None
+    a, b, c, d, dx, dy = affine
+    corners = [(bbox[0], bbox[1]), (bbox[0] + bbox[2] - 1, bbox[1] + bbox[3] - 1)]
+    exes = [a * x + b * y + dx for x, y in corners]
+    whys = [c * x + d * y + dy for x, y in corners]
+    return [min(exes), min(whys), max(exes) - min(exes) + 1, max(whys) - min(whys) + 1]
 def getbbox(grid):
     '''Returns the bounding box of a grid in the form [x, y, dx, dy].'''
+    if isinstance(grid, CellSet):
+        return grid.bbox
     grid = cleanupgrid(grid)
     if len(grid) == 0:
         #Empty patterns do not have a proper bounding box.
@@ -62,6 +145,66 @@ def getbbox(grid):
     dx = max(exes) - x + 1
     dy = max(whys) - y + 1
     return [x, y, dx, dy]
+#Soups are laid out from the 256 bits of a SHA-256 hash, as in apgsearch (https://github.com/PKTwentyTwo/apgsearch-Py3).
+#Each bit has a list of cells in the fundamental domain, and each symmetry adds copies of every cell so far:
+#a soup lists the cells of its set bits in order, then the image of that list under each block of transformations.
+SOUPWIDTHS = {'8x32': 32, '4x64': 64, '2x128': 128, '1x256': 256}
+SOUPDIAGONALS = {'D2_x': 1, 'D8_1': 1, 'D8_4': 1, 'D4_x1': 2, 'D4_x4': 2}
+SOUPTRANSFORMS = [
+    {'D2_x': (0, 1, 1, 0, 0, 0), 'D8_1': (0, 1, 1, 0, 0, 0), 'D8_4': (0, 1, 1, 0, 0, 0), 'D4_x1': (0, 1, 1, 0, 0, 0), 'D4_x4': (0, 1, 1, 0, 0, 0)},
+    {'D4_x1': (0, -1, -1, 0, 0, 0), 'D4_x4': (0, -1, -1, 0, -1, -1)},
+    {'D2_+1': (1, 0, 0, -1, 0, 0), 'D4_+1': (1, 0, 0, -1, 0, 0), 'D4_+2': (1, 0, 0, -1, 0, 0), 'D2_+2': (1, 0, 0, -1, 0, -1), 'D4_+4': (1, 0, 0, -1, 0, -1)},
+    {'D4_+1': (-1, 0, 0, 1, 0, 0), 'D4_+2': (-1, 0, 0, 1, -1, 0), 'D4_+4': (-1, 0, 0, 1, -1, 0)},
+    {'C2_1': (-1, 0, 0, -1, 0, 0), 'C4_1': (-1, 0, 0, -1, 0, 0), 'D8_1': (-1, 0, 0, -1, 0, 0), 'C2_2': (-1, 0, 0, -1, 0, -1),
+     'C2_4': (-1, 0, 0, -1, -1, -1), 'C4_4': (-1, 0, 0, -1, -1, -1), 'D8_4': (-1, 0, 0, -1, -1, -1)},
+    {'C4_1': (0, 1, -1, 0, 0, 0), 'D8_1': (0, 1, -1, 0, 0, 0), 'C4_4': (0, 1, -1, 0, 0, -1), 'D8_4': (0, 1, -1, 0, 0, -1)}
+    ]
+#The set bits of each byte, most significant first, as offsets 0 to 7:
+BYTEBITS = [[k for k in range(8) if value & (1 << (7 - k))] for value in range(256)]
+SOUPMAPS = {}
+def soupsymmetry(sym):
+    '''Converts a GPU symmetry (G or H) into the equivalent CPU symmetry (C or D).'''
+    if sym[0] in ['G', 'H'] and 'stdin' not in sym.lower() and len(sym) > 1:
+        return sym[0].replace('G', 'C').replace('H', 'D') + sym[1:]
+    return sym
+def soupmap(sym):
+    '''Returns the index map of a soup symmetry: for each block of transformations, the cells given by each of the 256 bits.
+Maps are built once per symmetry and cached.'''
+    sym = soupsymmetry(sym)
+    if sym in SOUPMAPS:
+        return SOUPMAPS[sym]
+    width = SOUPWIDTHS.get(sym, 16)
+    d = SOUPDIAGONALS.get(sym, 0)
+    base = []
+    for bit in range(256):
+        x = bit % width
+        y = bit // width
+        cells = []
+        if d == 0 or x >= y:
+            cells.append((x, y))
+        elif sym == 'D4_x1':
+            cells.append((y, -x))
+        elif sym == 'D4_x4':
+            cells.append((y, -x - 1))
+        if x == y and sym == 'D4_x1':
+            cells.append((y, -x))
+        if x == y and sym == 'D4_x4':
+            cells.append((y, -x - 1))
+        base.append(cells)
+    blocks = [IDENTITY]
+    for transforms in SOUPTRANSFORMS:
+        if sym in transforms:
+            blocks += [composeaffine(block, transforms[sym]) for block in blocks]
+    SOUPMAPS[sym] = [[[(a * x + b * y + dx, c * x + d * y + dy) for x, y in cells] for cells in base] for a, b, c, d, dx, dy in blocks]
+    return SOUPMAPS[sym]
+def soupgrids(instrings, sym):
+    '''Generates the soups for many seeds, yielding each as a grid.
+Each soup is the cells of its set bits looked up in the symmetry's index map, in the same order as apgsearch.'''
+    blocks = soupmap(sym)
+    for instring in instrings:
+        digest = hashlib.sha256(instring.encode('utf-8')).digest()
+        bits = [8 * j + k for j, value in enumerate(digest) for k in BYTEBITS[value]]
+        yield dict.fromkeys([cell for block in blocks for bit in bits for cell in block[bit]], 1)
 def sha1(instring):
     '''Return an integer representation of the SHA-1 hash of a string.'''
     hashed = hashlib.sha1(instring.encode('utf-8')).digest()
@@ -69,132 +212,360 @@ def sha1(instring):
     for x in range(20):
         totalint += (256**x) * hashed[x]
     return totalint
-def defaultshiftgrid(grid):
-    '''Move a grid so that all coordinates are non-negative.'''
-    grid = cleanupgrid(grid)
-    bbox = getbbox(grid)
-    return shiftgrid(grid, -bbox[0], -bbox[1])
+#Digests are polynomial hashes modulo a Mersenne prime:
+#each cell (x, y) contributes DIGEST_A**x * DIGEST_B**y, multiplied by its state.
+DIGEST_MODULUS = 2**61 - 1
+DIGEST_A = 0x1d8e4e27c47d124f % DIGEST_MODULUS
+DIGEST_B = 0x2545f4914f6cdd1d % DIGEST_MODULUS
+def digestpowers(base, length):
+    '''Returns the first few powers of a digest base.'''
+    powers = [1] * length
+    for x in range(1, length):
+        powers[x] = powers[x - 1] * base % DIGEST_MODULUS
+    return powers
 def calcdigest(grid):
     '''Returns a digest of a grid, dependent on rotation and reflection but not absolute position.'''
-    grid = defaultshiftgrid(grid)
-    total = 0
-    for x in grid:
-        total += sha1(str(x))
-    return total
+    cells = [x for x in grid if grid[x] != 0]
+    if len(cells) == 0:
+        return 0
+    x0 = min(c[0] for c in cells)
+    y0 = min(c[1] for c in cells)
+    powa = digestpowers(DIGEST_A, max(c[0] for c in cells) - x0 + 1)
+    powb = digestpowers(DIGEST_B, max(c[1] for c in cells) - y0 + 1)
+    digest = 0
+    for x, y in cells:
+        digest += powa[x - x0] * powb[y - y0] * grid[(x, y)]
+    return digest % DIGEST_MODULUS
 def calcoctodigest(grid):
     '''Returns a digest of a grid, independent of rotation, reflection, and position.'''
-    total = 0
-    transformgrided = [grid, transformgrid(grid, 'rot_90'), transformgrid(grid, 'rot_180'), transformgrid(grid, 'rot_270')]
-    transformgrided += [transformgrid(transformgrid(grid, 'flip_x'), 'rot_90'), transformgrid(transformgrid(grid, 'flip_x'), 'rot_180'), transformgrid(transformgrid(grid, 'flip_x'), 'rot_270'), transformgrid(transformgrid(grid, 'flip_x'), 'identity')]
-    for x in transformgrided:
-        total += calcdigest(x)
-    return total
+    cells = [x for x in grid if grid[x] != 0]
+    if len(cells) == 0:
+        return 0
+    x0 = min(c[0] for c in cells)
+    y0 = min(c[1] for c in cells)
+    w = max(c[0] for c in cells) - x0
+    h = max(c[1] for c in cells) - y0
+    powa = digestpowers(DIGEST_A, max(w, h) + 1)
+    powb = digestpowers(DIGEST_B, max(w, h) + 1)
+    digest = 0
+    #Sum the digests of all 8 orientations in a single pass:
+    for x, y in cells:
+        state = grid[(x, y)]
+        x -= x0
+        y -= y0
+        u = w - x
+        v = h - y
+        digest += (powa[x] * (powb[y] + powb[v]) + powa[u] * (powb[y] + powb[v])
+                   + powa[y] * (powb[x] + powb[u]) + powa[v] * (powb[x] + powb[u])) * state
+    return digest % DIGEST_MODULUS
+class RollingDigest:
+    '''A digest that is updated as cells change state, rather than recomputed.'''
+    def __init__(self, grid=None):
+        self.raw = 0
+        self.population = 0
+        self.exes = {}
+        self.whys = {}
+        self.bounds = None
+        if grid is not None:
+            for x in grid:
+                if grid[x] != 0:
+                    self.change(x, 0, grid[x])
+    def change(self, cell, old, new):
+        '''Records that the state of a cell has changed from old to new.'''
+        x, y = cell
+        term = pow(DIGEST_A, x, DIGEST_MODULUS) * pow(DIGEST_B, y, DIGEST_MODULUS)
+        self.raw = (self.raw + (new - old) * term) % DIGEST_MODULUS
+        if old != 0 and new != 0:
+            return
+        alive = new != 0
+        step = 1 if alive else -1
+        self.population += step
+        for counts, key in ((self.exes, x), (self.whys, y)):
+            count = counts.get(key, 0) + step
+            if count == 0:
+                del counts[key]
+            else:
+                counts[key] = count
+        bounds = self.bounds
+        if bounds is not None:
+            if alive:
+                self.bounds = (min(bounds[0], x), min(bounds[1], y))
+            elif x == bounds[0] and x not in self.exes or y == bounds[1] and y not in self.whys:
+                #The minimum has been removed, so find it again when it is next needed:
+                self.bounds = None
+    @property
+    def origin(self):
+        '''The top-left corner of the bounding box of the recorded cells.'''
+        if self.population == 0:
+            return None
+        if self.bounds is None:
+            self.bounds = (min(self.exes), min(self.whys))
+        return self.bounds
+    @property
+    def digest(self):
+        '''Equal to calcdigest of the recorded cells.'''
+        if self.population == 0:
+            return 0
+        x0, y0 = self.origin
+        return self.raw * pow(DIGEST_A, -x0, DIGEST_MODULUS) * pow(DIGEST_B, -y0, DIGEST_MODULUS) % DIGEST_MODULUS
+#The offsets of the neighbours that join cells into one component. Only half of each
+#neighbourhood is listed, since every pair of neighbours only needs to be joined once:
+NEIGHBOURHOODS = {
+    'moore': [(1, 0), (-1, 1), (0, 1), (1, 1)],
+    'vonneumann': [(1, 0), (0, 1)],
+    'distance2': [(x, y) for y in range(3) for x in range(-2, 3) if y > 0 or x > 0]
+    }
+def labelcomponents(grid, neighbourhood='moore'):
+    '''Splits the live cells of a grid into connected components using union-find, returning a list of lists of cells.
+The neighbourhood may be moore, vonneumann, or distance2 (cells up to 2 apart in each direction, as apgsearch groups ash).'''
+    if neighbourhood not in NEIGHBOURHOODS:
+        raise ValueError('Only the following neighbourhoods are supported: '+str(list(NEIGHBOURHOODS)))
+    offsets = NEIGHBOURHOODS[neighbourhood]
+    cells = [x for x in grid if grid[x] != 0]
+    index = {cell: n for n, cell in enumerate(cells)}
+    parent = list(range(len(cells)))
+    def find(n):
+        while parent[n] != n:
+            #Path halving keeps the trees shallow:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+    for n, (x, y) in enumerate(cells):
+        for dx, dy in offsets:
+            other = index.get((x + dx, y + dy))
+            if other is not None:
+                a = find(n)
+                b = find(other)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+    components = {}
+    for n, cell in enumerate(cells):
+        root = find(n)
+        if root not in components:
+            components[root] = []
+        components[root].append(cell)
+    return list(components.values())
+def mergegroups(groups, failed):
+    '''Merges each group of cells listed in failed with the other failed groups within distance 2 of it,
+or with the nearest group by bounding box if there are none, returning the new list of groups.'''
+    owner = {cell: n for n, group in enumerate(groups) for cell in group}
+    parent = list(range(len(groups)))
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+    offsets = [(x, y) for y in range(-2, 3) for x in range(-2, 3) if (x, y) != (0, 0)]
+    bboxes = [getbbox(dict.fromkeys(group, 1)) for group in groups]
+    for n in failed:
+        partners = set()
+        for x, y in groups[n]:
+            for dx, dy in offsets:
+                m = owner.get((x + dx, y + dy))
+                if m is not None and m != n and m in failed:
+                    partners.add(m)
+        if len(partners) == 0:
+            #Measure the gap between bounding boxes in the worse of the two directions:
+            a = bboxes[n]
+            gaps = []
+            for m, b in enumerate(bboxes):
+                if m != n:
+                    gap = max(b[0] - a[0] - a[2], a[0] - b[0] - b[2], b[1] - a[1] - a[3], a[1] - b[1] - b[3])
+                    gaps.append((gap, m))
+            partners.add(min(gaps)[1])
+        for m in partners:
+            a = find(n)
+            b = find(m)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    merged = {}
+    for n, group in enumerate(groups):
+        root = find(n)
+        if root not in merged:
+            merged[root] = []
+        merged[root].extend(group)
+    return list(merged.values())
+def touchinggroups(groups):
+    '''Lists, for each group of cells, the indices of the other groups with a cell in its Moore neighbourhood.'''
+    owner = {cell: n for n, group in enumerate(groups) for cell in group}
+    offsets = [(x, y) for y in range(-1, 2) for x in range(-1, 2) if (x, y) != (0, 0)]
+    touching = [set() for group in groups]
+    for n, group in enumerate(groups):
+        for x, y in group:
+            for dx, dy in offsets:
+                m = owner.get((x + dx, y + dy))
+                if m is not None and m != n:
+                    touching[n].add(m)
+    return touching
 def applyop(grid1, grid2, operation):
     '''Applies an operation to two grids.'''
+    if isinstance(grid1, CellSet) and isinstance(grid2, CellSet):
+        operation = operation.lower()
+        if operation ==  'add':
+            return grid1.union(grid2)
+        if operation ==  'sub':
+            return grid1.difference(grid2)
+        if operation ==  'xor':
+            return grid1.symmetric_difference(grid2)
+        return {}
     grid1 = cleanupgrid(grid1)
     grid2 = cleanupgrid(grid2)
     operation = operation.lower()
     newgrid = {}
     set1 = set(grid1)
     set2 = set(grid2)
+    #Cells keep their states, taken from the first grid where both have a cell:
     if operation ==  'add':
         set3 = set1.union(set2)
-        newgrid = {x:1 for x in set3}
+        newgrid = {x:grid1[x] if x in grid1 else grid2[x] for x in set3}
     elif operation ==  'sub':
         set3 = set1.difference(set2)
-        newgrid = {x:1 for x in set3}
+        newgrid = {x:grid1[x] for x in set3}
     elif operation ==  'xor':
         set3 = (set1.difference(set2)).union((set2.difference(set1)))
-        newgrid = {x:1 for x in set3}
+        newgrid = {x:grid1[x] if x in grid1 else grid2[x] for x in set3}
     return newgrid
-def getcell(grid, tupleused):
-    '''Gets the value of a cell.'''
-    if tupleused in grid:
-        return 1
-    return 0
-def getgridapgcode(grid):
-    '''Finds the apgcode of a grid.'''
-    #Documentation of apgcode format can be found at:
-    #https://conwaylife.com/wiki/Apgcode
-    #To my future self:
-    #This function is a mess, but if all else fails,
-    #Check apgsearch Py3 code to understand how it works.
-    characters = '0123456789abcdefghijklmnopqrstuvwxyz'
+def combinegrids(views, operation):
+    '''Applies an operation to many grids at once, building a single new grid.
+Each view is a (grid, affine) pair, and the affine map (or None) is applied to each cell as it is read.
+add and xor take the state of a cell from the first grid that has it, and sub removes every later grid from the first.'''
+    operation = operation.lower()
+    operations = ['add', 'sub', 'xor']
+    if operation not in operations:
+        raise ValueError('Only the following operations are supported: '+str(operations))
+    newgrid = {}
+    compact = True
+    for n, (grid, affine) in enumerate(views):
+        compact = compact and isinstance(grid, CellSet)
+        cells = grid.items()
+        if affine is not None and affine != IDENTITY:
+            a, b, c, d, dx, dy = affine
+            cells = (((a * x + b * y + dx, c * x + d * y + dy), state) for (x, y), state in cells)
+        if operation == 'add':
+            for cell, state in cells:
+                if state != 0 and cell not in newgrid:
+                    newgrid[cell] = state
+        elif operation == 'xor':
+            for cell, state in cells:
+                if state == 0:
+                    continue
+                if cell in newgrid:
+                    del newgrid[cell]
+                else:
+                    newgrid[cell] = state
+        elif n == 0:
+            newgrid = {cell: state for cell, state in cells if state != 0}
+        else:
+            for cell, state in cells:
+                if state != 0:
+                    newgrid.pop(cell, None)
+    if compact:
+        #Combining compact grids keeps the result compact:
+        return CellSet(newgrid)
+    return newgrid
+def gridsequal(grid1, grid2):
+    '''Checks whether two grids without dead cells hold the same cells in the same states, stopping at the first difference.'''
+    if len(grid1) != len(grid2):
+        return False
+    if isinstance(grid1, CellSet) and isinstance(grid2, CellSet):
+        return grid1 == grid2
+    for cell, state in grid1.items():
+        if grid2.get(cell) != state:
+            return False
+    return True
+#Documentation of apgcode format can be found at:
+#https://conwaylife.com/wiki/Apgcode
+#Each character holds a column of a 5-row strip, with the top cell in the lowest bit, and z separates strips.
+APGCODE_CHARACTERS = '0123456789abcdefghijklmnopqrstuvwxyz'
+#Runs of zeroes are compressed: w is 00, x is 000, and y0 through yz are 4 through 39 zeroes.
+#Longer runs are split into runs of 39, so a run of n zeroes is n // 39 copies of yz, then ZERORUNS[n % 39].
+ZERORUNS = ['', '0', 'w', 'x'] + ['y' + c for c in APGCODE_CHARACTERS[:35]]
+ZERORUN = re.compile('00+')
+APGCODE_TOKENS = re.compile('y(.?)|(.)', re.DOTALL)
+APGCODE_COLUMNS = [[h for h in range(5) if (value >> h) & 1] for value in range(32)]
+def packgrid(grid):
+    '''Packs the live cells of a grid into bitmasks relative to its bounding box, in a single pass over the cells.
+Returns the masks of each column (bit y is set for each live cell), the same with the bits reversed,
+the masks of each row (bit x), the same with the bits reversed, and the width and height of the grid.
+Read as columns, these hold the grid flipped vertically, transposed, and transposed then flipped.'''
     grid = cleanupgrid(grid)
-    grid = defaultshiftgrid(grid)
-    #Empty grids have no live cells:
     if len(grid) == 0:
+        return [], [], [], [], 0, 0
+    x0, y0, width, height = getbbox(grid)
+    columns = [0] * width
+    flippedcolumns = [0] * width
+    rows = [0] * height
+    flippedrows = [0] * height
+    bottom = y0 + height - 1
+    right = x0 + width - 1
+    for x, y in grid:
+        columns[x - x0] |= 1 << (y - y0)
+        flippedcolumns[x - x0] |= 1 << (bottom - y)
+        rows[y - y0] |= 1 << (x - x0)
+        flippedrows[y - y0] |= 1 << (right - x)
+    return columns, flippedcolumns, rows, flippedrows, width, height
+def compresszeroes(match):
+    '''Replaces a run of zeroes in an apgcode with its compressed form.'''
+    length = len(match.group())
+    return 'yz' * (length // 39) + ZERORUNS[length % 39]
+def encodecolumns(columns, height):
+    '''Encodes a grid given as the bitmasks of its columns (see packgrid) as the body of an apgcode.
+Each strip is built with one lookup per column, and its zeroes are compressed in one linear pass.'''
+    if len(columns) == 0:
         return '0'
-    #Get the bounding box of the pattern:
-    bbox = getbbox(grid)
-    x, y, dx, dy = bbox[0], bbox[1], bbox[2], bbox[3]
-    apgcode = ''
-    for w in range((dy - 1)//5 + 1):
-        if w != 0:
-            apgcode += 'z'
-        for l in range(dx):
-            val = 0
-            for h in range(5):
-                val += ((2**h) * getcell(grid, (x + l, y + 5 * w + h)))
-            apgcode += characters[val]
-    #Remove zeroes from the end of lines:
-    while apgcode.count('0z') > 0:
-        apgcode = apgcode.replace('0z', 'z')
-    #Use the format's compression of zeroes:
-    #w corresponds to 00
-    #x corresponds to 000
-    #y0 through yz correspond to 4 through 39 zeroes, respectively.
-    for a in range(39, 3, -1):
-        apgcode = apgcode.replace('0' * a, 'y' + characters[a-4])
-    apgcode = apgcode.replace('000', 'x')
-    apgcode = apgcode.replace('00', 'w')
-    forbiddenend = ['w', 'x', 'z', '0', 'y']
-    #forbiddenend += [n + '0' for n in forbiddenend]
-    forbiddenend += ['y' + a for a in characters]
-    forbiddenbeforez = ['x']
-    if len(apgcode) > 0:
-        while (apgcode[-1] in forbiddenend or apgcode[-2:] in forbiddenend):
-            apgcode = apgcode[:-1]
-    for z in forbiddenbeforez:
-        while apgcode.count(z + 'z') > 0:
-            apgcode = apgcode.replace(z + 'z', 'z')
-    return apgcode
+    strips = []
+    for shift in range(0, height, 5):
+        strip = ''.join([APGCODE_CHARACTERS[(column >> shift) & 31] for column in columns])
+        #Zeroes at the end of a strip are implied:
+        strips.append(ZERORUN.sub(compresszeroes, strip.rstrip('0')))
+    return 'z'.join(strips)
+def getgridapgcode(grid):
+    '''Finds the apgcode of a grid.'''
+    packed = packgrid(grid)
+    return encodecolumns(packed[0], packed[5])
+def getorientationcodes(grid):
+    '''Finds the apgcodes of all 8 orientations of a grid, encoding each from one bit-packed copy of its cells.'''
+    columns, flippedcolumns, rows, flippedrows, width, height = packgrid(grid)
+    codes = []
+    for masks, length in ((columns, height), (flippedcolumns, height), (rows, width), (flippedrows, width)):
+        codes.append(encodecolumns(masks, length))
+        #Reversing the order of the masks flips the grid horizontally:
+        codes.append(encodecolumns(masks[::-1], length))
+    return codes
 def apgcodetogrid(apgcode):
-    '''Converts an apgcode to a grid.'''
+    '''Converts an apgcode to a grid, decoding it in one linear pass.'''
     xpos = 0
     ypos = 0
-    readpos = 0
     grid = {}
-    characters = '0123456789abcdefghijklmnopqrstuvwxyz'
     apgcode = apgcode[apgcode.find('_')+1:]
-    #Convert special characters to zeroes:
-    for x in range(35, -1, -1):
-        apgcode = apgcode.replace('y' + characters[x], '0' * (x + 4))
-    apgcode = apgcode.replace('x', '000')
-    apgcode = apgcode.replace('w', '00')
-    #Go through and convert the apgcode into a grid:
-    while readpos < len(apgcode):
-        character = apgcode[readpos]
-        value = characters.find(character)
+    for run, character in APGCODE_TOKENS.findall(apgcode):
+        if run:
+            #y followed by a character is a run of 4 to 39 zeroes:
+            value = APGCODE_CHARACTERS.find(run)
+            if value < 0:
+                raise ValueError('Illegal character in apgcode: '+run)
+            xpos += value + 4
+            continue
+        if not character:
+            #A y at the very end has nothing to count.
+            continue
+        value = APGCODE_CHARACTERS.find(character)
         if value < 0:
             raise ValueError('Illegal character in apgcode: '+character)
-        if 0 <= value < 32:
+        if value < 32:
             #We have a character denoting content.
-            for x in range(5):
-                if (value//(2**x))%2 == 1:
-                    grid[(xpos, ypos + x)] = 1
+            for h in APGCODE_COLUMNS[value]:
+                grid[(xpos, ypos + h)] = 1
             xpos += 1
-        elif value == 35:
+        elif value == 32:
+            xpos += 2
+        elif value == 33:
+            xpos += 3
+        else:
             #z denotes the next 5-row segment.
             xpos = 0
             ypos += 5
-        readpos += 1
     return grid
-def getorientations(grid):
-    '''Return all 8 transformations of a grid.'''
-    transformed = [grid, transformgrid(grid, 'rot_90'), transformgrid(grid, 'rot_180'), transformgrid(grid, 'rot_270')]
-    transformed += [transformgrid(transformgrid(grid, 'flip_x'), 'rot_90'), transformgrid(transformgrid(grid, 'flip_x'), 'rot_180'), transformgrid(transformgrid(grid, 'flip_x'), 'rot_270'), transformgrid(transformgrid(grid, 'flip_x'), 'identity')]
-    return transformed
 def compareapgcode(code1, code2):
     '''Compares two apgcodes, prioritising length first and using alphabetical order for tie-breaking.'''
     if code1 == code2:
@@ -210,11 +581,15 @@ def compareapgcode(code1, code2):
     #This bit should be unreachable:
     return code1
 def identifytype(data):
-    '''Determines whether pattern data is a grid, apgcode, or RLE.'''
-    if type(data) == type({}):
+    '''Determines whether pattern data is a grid, binary pattern, macrocell, apgcode, or RLE.'''
+    if type(data) == type({}) or isinstance(data, CellSet):
         return 'grid'
+    if isinstance(data, (bytes, bytearray, memoryview, mmap.mmap)):
+        return 'binary'
     if type(data) != type('string'):
-        raise TypeError('Class \'Pattern\' only accepts strings or dictionaries as data, not '+str(type(data)))
+        raise TypeError('Class \'Pattern\' only accepts strings, dictionaries or bytes as data, not '+str(type(data)))
+    if data.startswith('[M2]'):
+        return 'macrocell'
     if data.count('_') == 0 or len(data) == 0 or not data.startswith('x'):
         return 'rle'
     #Catch out rle-exclusive characters:
@@ -0,0 +1,188 @@
+'''A hash-consed quadtree engine (Hashlife) used as an alternate Lifetree backend.'''
+try:
+    from .hensel import RuleHandler
+except ImportError:
+    from hensel import RuleHandler
+class Node:
+    '''A canonical quadtree node. Level 0 nodes are single cells.'''
+    __slots__ = ('level', 'nw', 'ne', 'sw', 'se', 'population')
+    def __init__(self, level, nw, ne, sw, se, population):
+        self.level = level
+        self.nw = nw
+        self.ne = ne
+        self.sw = sw
+        self.se = se
+        self.population = population
+class HashlifeEngine:
+    '''Advances grids using memoized quadtree successors.'''
+    def __init__(self, table, maxnodes=2**20):
+        if table[0]:
+            raise ValueError('B0 rules are not supported by the hashlife engine.')
+        self.table = table
+        self.blocks = RuleHandler().blocktable(table)
+        self.maxnodes = maxnodes
+        self.off = Node(0, None, None, None, None, 0)
+        self.on = Node(0, None, None, None, None, 1)
+        self.clear()
+    def __deepcopy__(self, memo):
+        '''The node cache is shared between copies of a Lifetree.'''
+        return self
+    def clear(self):
+        '''Empties the node and successor caches.'''
+        self.nodes = {}
+        self.results = {}
+        self.empties = [self.off]
+    def join(self, nw, ne, sw, se):
+        '''Returns the canonical node with the given children.'''
+        key = (nw, ne, sw, se)
+        node = self.nodes.get(key)
+        if node is None:
+            population = nw.population + ne.population + sw.population + se.population
+            node = Node(nw.level + 1, nw, ne, sw, se, population)
+            self.nodes[key] = node
+        return node
+    def empty(self, level):
+        '''Returns the empty node of a given level.'''
+        empties = self.empties
+        while len(empties) <= level:
+            e = empties[-1]
+            empties.append(self.join(e, e, e, e))
+        return empties[level]
+    def expand(self, node):
+        '''Returns a node one level higher with the original in its centre.'''
+        e = self.empty(node.level - 1)
+        return self.join(self.join(e, e, e, node.nw), self.join(e, e, node.ne, e),
+                         self.join(e, node.sw, e, e), self.join(node.se, e, e, e))
+    def centre(self, node):
+        '''Returns the central node one level lower.'''
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+    def iscentred(self, node):
+        '''Checks whether all live cells lie within the central half of a node.'''
+        if node.level < 2:
+            return False
+        nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+        outer = (nw.nw, nw.ne, nw.sw, ne.nw, ne.ne, ne.se, sw.nw, sw.sw, sw.se, se.ne, se.sw, se.se)
+        for x in outer:
+            if x.population != 0:
+                return False
+        return True
+    def fromgrid(self, grid):
+        '''Builds a node from a grid, returning the node and its top-left corner.'''
+        cells = [c for c in grid if grid[c] != 0]
+        x = min(c[0] for c in cells)
+        y = min(c[1] for c in cells)
+        size = max(max(c[0] for c in cells) - x, max(c[1] for c in cells) - y) + 1
+        level = 2
+        while (1 << level) < size:
+            level += 1
+        cells = [(c[0] - x, c[1] - y) for c in cells]
+        return self.build(cells, level), x, y
+    def build(self, cells, level):
+        '''Recursively builds a node from a list of local coordinates.'''
+        if not cells:
+            return self.empty(level)
+        if level == 0:
+            return self.on
+        half = 1 << (level - 1)
+        quads = ([], [], [], [])
+        for x, y in cells:
+            index = (x >= half) + 2 * (y >= half)
+            quads[index].append((x % half, y % half))
+        return self.join(self.build(quads[0], level - 1), self.build(quads[1], level - 1),
+                         self.build(quads[2], level - 1), self.build(quads[3], level - 1))
+    def togrid(self, node, x, y):
+        '''Converts a node with its top-left corner at (x, y) back into a grid.'''
+        grid = {}
+        stack = [(node, x, y)]
+        while stack:
+            node, x, y = stack.pop()
+            if node.population == 0:
+                continue
+            if node.level == 0:
+                grid[(x, y)] = 1
+                continue
+            half = 1 << (node.level - 1)
+            stack.append((node.nw, x, y))
+            stack.append((node.ne, x + half, y))
+            stack.append((node.sw, x, y + half))
+            stack.append((node.se, x + half, y + half))
+        return grid
+    def basecase(self, node):
+        '''Advances the centre of a level 2 node by one generation.'''
+        bits = 0
+        for quad, (qx, qy) in ((node.nw, (0, 0)), (node.ne, (2, 0)), (node.sw, (0, 2)), (node.se, (2, 2))):
+            for cell, (cx, cy) in ((quad.nw, (0, 0)), (quad.ne, (1, 0)), (quad.sw, (0, 1)), (quad.se, (1, 1))):
+                if cell.population:
+                    bits |= 1 << (qx + cx + 4 * (qy + cy))
+        result = self.blocks[bits]
+        newcells = [self.on if result >> x & 1 else self.off for x in range(4)]
+        return self.join(newcells[0], newcells[1], newcells[2], newcells[3])
+    def successor(self, node, j):
+        '''Returns the centre of a node advanced 2**j generations (j is capped at level - 2).'''
+        j = min(j, node.level - 2)
+        key = (node, j)
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        if node.population == 0:
+            result = node.nw
+        elif node.level == 2:
+            result = self.basecase(node)
+        else:
+            join = self.join
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            c1 = self.successor(nw, j)
+            c2 = self.successor(join(nw.ne, ne.nw, nw.se, ne.sw), j)
+            c3 = self.successor(ne, j)
+            c4 = self.successor(join(nw.sw, nw.se, sw.nw, sw.ne), j)
+            c5 = self.successor(join(nw.se, ne.sw, sw.ne, se.nw), j)
+            c6 = self.successor(join(ne.sw, ne.se, se.nw, se.ne), j)
+            c7 = self.successor(sw, j)
+            c8 = self.successor(join(sw.ne, se.nw, sw.se, se.sw), j)
+            c9 = self.successor(se, j)
+            if j < node.level - 2:
+                #The children have already been advanced far enough:
+                result = join(join(c1.se, c2.sw, c4.ne, c5.nw), join(c2.se, c3.sw, c5.ne, c6.nw),
+                              join(c4.se, c5.sw, c7.ne, c8.nw), join(c5.se, c6.sw, c8.ne, c9.nw))
+            else:
+                result = join(self.successor(join(c1, c2, c4, c5), j), self.successor(join(c2, c3, c5, c6), j),
+                              self.successor(join(c4, c5, c7, c8), j), self.successor(join(c5, c6, c8, c9), j))
+        self.results[key] = result
+        return result
+    def advance(self, grid, gens):
+        '''Advance a grid a specific number of generations.'''
+        if gens == 0 or len(grid) == 0:
+            return dict(grid)
+        if len(self.nodes) > self.maxnodes:
+            self.clear()
+        if not any(grid.values()):
+            return {}
+        node, x, y = self.fromgrid(grid)
+        j = 0
+        while gens > 0:
+            if gens & 1:
+                #Pad the node so nothing can escape the result within 2**j generations:
+                while node.level < j + 2 or not self.iscentred(node):
+                    half = 1 << (node.level - 1)
+                    node = self.expand(node)
+                    x -= half
+                    y -= half
+                half = 1 << (node.level - 1)
+                node = self.expand(node)
+                x -= half
+                y -= half
+                quarter = 1 << (node.level - 2)
+                node = self.successor(node, j)
+                x += quarter
+                y += quarter
+                if node.population == 0:
+                    return {}
+                #Crop away empty borders:
+                while node.level > 2 and self.iscentred(node):
+                    quarter = 1 << (node.level - 2)
+                    node = self.centre(node)
+                    x += quarter
+                    y += quarter
+            gens >>= 1
+            j += 1
+        return self.togrid(node, x, y)
@@ -1,7 +1,12 @@
 '''This module contains a class, RuleHandler, for dealing with Hensel notation.'''
+import base64
 import re
+#Compiled rules, shared by every RuleHandler and keyed by the rule string as given:
+COMPILEDRULES = {}
+#4x4 to 2x2 block tables, keyed by the 512-entry table they were built from:
+BLOCKTABLES = {}
 class RuleHandler:
-    '''Responsible for handling Hensel notation.'''
+    '''Responsible for handling Hensel notation, and the Generations and MAP rules built on it.'''
     def __init__(self):
         '''Only needs to set up some read-only variables.'''
         #Dictionary mapping digits to their Hensel notation letters.
@@ -16,15 +21,34 @@ class RuleHandler:
             '7':['c', 'e'],
             '8':['']
             }
+    def splitrule(self, rule):
+        '''Splits a rule into its family ('hensel', 'generations' or 'map'), its two-state part and its number of states.
+Generations rules may be written as B2/S345/G4, B2/S345/C4, b2s345g4 or g4b2s345.'''
+        if rule[:3].upper() == 'MAP':
+            return ('map', rule[3:].rstrip('='), 2)
+        lowered = rule.lower()
+        for pattern, body, states in (('(.*)/[gc]([0-9]+)', 1, 2), ('g([0-9]+)/?(b.*)', 2, 1), ('(b[^g]*)g([0-9]+)', 1, 2)):
+            match = re.fullmatch(pattern, lowered)
+            if match:
+                return ('generations', match.group(body), int(match.group(states)))
+        return ('hensel', rule, 2)
     def isvalid(self, rule):
         '''Checks if a rule is valid using regex.'''
+        family, rule, states = self.splitrule(rule)
+        if family == 'map':
+            return bool(re.fullmatch('[A-Za-z0-9+/]{86}', rule))
+        if states < 2 or states > 256:
+            return False
         rule = rule.lower().replace('/', '')
         return bool(re.match('b[1-8ceaiknjqrytwz-]*s[0-8ceaiknjqrytwz-]*', rule))
     def parserule(self, rule):
         '''Takes a rule and returns a list of birth and survival conditions.'''
         #I hate having to code parsers.
         if not self.isvalid(rule):
-            raise ValueError('Rule does not match regex b[1-8ceaiknjqrytwz-]*s[0-8ceaiknjqrytwz-]*')
+            raise ValueError('Rule does not match regex b[1-8ceaiknjqrytwz-]*s[0-8ceaiknjqrytwz-]*, with at most 256 Generations states, or MAP followed by 86 base64 characters')
+        family, rule, states = self.splitrule(rule)
+        if family == 'map':
+            raise ValueError('MAP rules cannot be written as Hensel conditions.')
         #Convert the rule to a fixed format:
         rule = rule.lower().replace('/', '')
         conditiondict = self.conditiondict
@@ -116,6 +140,9 @@ class RuleHandler:
                 for n in missing_conditions:
                     rulestring += n
                 continue
+        if birth:
+            #Rules without survival conditions still need the S:
+            rulestring += '/S'
         return rulestring
     def get_9bit(self, condition):
         '''Returns a list of 9-bit decimal numbers, used to apply INT rules.'''
@@ -238,6 +265,10 @@ class RuleHandler:
         return []
     def makeconditionset(self, rule):
         '''Creates the condition set used by a lifetree.'''
+        family, body, states = self.splitrule(rule)
+        if family == 'map':
+            table = self.decodemap(body)
+            return {x for x in range(512) if table[x]}
         numeric_conditions = []
         conditions = self.parserule(rule)
         for x in conditions:
@@ -245,5 +276,84 @@ class RuleHandler:
         numeric_conditions.sort()
         return set(numeric_conditions)
     def canoniserule(self, rule):
-        '''Canonises a rule to a fixed format.'''
-        return self.tohensel(self.parserule(rule)).lower().replace('/', '')
+        '''Canonises a rule to a fixed format.
+Generations rules become g4b2s345, and MAP rules are re-encoded so that unused bits are zero.'''
+        family, body, states = self.splitrule(rule)
+        if family == 'map':
+            if not self.isvalid(rule):
+                raise ValueError('MAP rules must be followed by 86 base64 characters.')
+            table = self.decodemap(body)
+            if table[0]:
+                #Every engine only evaluates cells next to live cells, so empty neighbourhoods never give births:
+                raise ValueError('B0 rules are not supported.')
+            return 'MAP' + self.encodemap(table)
+        canonical = self.tohensel(self.parserule(rule)).lower().replace('/', '')
+        if states > 2:
+            return 'g' + str(states) + canonical
+        return canonical
+    def rulerange(self, minrule, maxrule):
+        '''Yields every isotropic rule with all the conditions of minrule and only conditions of maxrule, in canonical form.'''
+        minimum = set(self.parserule(minrule))
+        maximum = set(self.parserule(maxrule))
+        if not minimum <= maximum:
+            raise ValueError('The conditions of the minimum rule must all be in the maximum rule.')
+        free = sorted(maximum - minimum)
+        for n in range(2 ** len(free)):
+            conditions = list(minimum) + [free[x] for x in range(len(free)) if n >> x & 1]
+            yield self.tohensel(conditions).lower().replace('/', '')
+    def rlerule(self, rule):
+        '''Formats a canonical rule for the header of an RLE, e.g B3/S23, B2/S345/C4 or MAP...'''
+        family, body, states = self.splitrule(rule)
+        if family == 'map':
+            return 'MAP' + body
+        body = body.replace('b', 'B').replace('s', '/S')
+        if family == 'generations':
+            return body + '/C' + str(states)
+        return body
+    def decodemap(self, body):
+        '''Converts the base64 part of a MAP rule into a 512-entry transition table.'''
+        bits = base64.b64decode(body[:86] + '==')
+        table = bytearray(512)
+        for x in range(512):
+            #MAP strings put the top-left cell in the most significant bit, the reverse of the table index:
+            index = int(format(x, '09b')[::-1], 2)
+            table[x] = (bits[index >> 3] >> (7 - (index & 7))) & 1
+        return bytes(table)
+    def encodemap(self, table):
+        '''Converts a 512-entry transition table into the base64 part of a MAP rule.'''
+        bits = bytearray(64)
+        for x in range(512):
+            if table[x]:
+                index = int(format(x, '09b')[::-1], 2)
+                bits[index >> 3] |= 128 >> (index & 7)
+        return base64.b64encode(bytes(bits)).decode('ascii')[:86]
+    def maketable(self, rule):
+        '''Creates a 512-entry transition table, indexed by 9-bit neighbourhoods, holding 1 where the centre cell is alive next generation.
+For Generations rules, the table gives the births and survivals of cells in state 1.'''
+        table = bytearray(512)
+        for x in self.makeconditionset(rule):
+            table[x] = 1
+        return bytes(table)
+    def compilerule(self, rule):
+        '''Returns the canonical form, transition table and number of states of a rule, computing them only once per rule string.'''
+        if rule not in COMPILEDRULES:
+            canonical = self.canoniserule(rule)
+            if canonical not in COMPILEDRULES:
+                COMPILEDRULES[canonical] = (canonical, self.maketable(canonical), self.splitrule(canonical)[2])
+            COMPILEDRULES[rule] = COMPILEDRULES[canonical]
+        return COMPILEDRULES[rule]
+    def blocktable(self, table):
+        '''Creates a 65536-entry table advancing the 4x4 block whose cell (x, y) is bit x + 4 * y,
+giving its central 2x2 block as a 4-bit value with bits for (1, 1), (2, 1), (1, 2) and (2, 2).'''
+        if table in BLOCKTABLES:
+            return BLOCKTABLES[table]
+        #Each output pair of cells only depends on three consecutive rows of four cells:
+        pairs = []
+        for rows in range(4096):
+            r0, r1, r2 = rows & 15, (rows >> 4) & 15, rows >> 8
+            left = table[(r0 & 7) | (r1 & 7) << 3 | (r2 & 7) << 6]
+            right = table[(r0 >> 1) | (r1 >> 1) << 3 | (r2 >> 1) << 6]
+            pairs.append(left | right << 1)
+        blocks = bytes([pairs[x & 4095] | pairs[x >> 4] << 2 for x in range(65536)])
+        BLOCKTABLES[table] = blocks
+        return blocks
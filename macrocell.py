@@ -0,0 +1,151 @@
+'''A streaming reader and writer for Golly's macrocell (.mc) format, which stores a pattern as a quadtree of distinct nodes.'''
+try:
+    from .rle import readchunks
+except ImportError:
+    from rle import readchunks
+#Files start with a header line, then optional # lines (#R gives the rule), then one line per distinct node.
+#Nodes are numbered from 1 in the order they are written, and 0 stands for an empty node of any level.
+#A line 'level nw ne sw se' joins four earlier nodes of the level below into a square of side 2**level.
+#Two-state patterns use 8x8 leaves (level 3), written as rows of . and * ending in $, without trailing dead cells or rows.
+#Multi-state patterns use 2x2 leaves instead, written as '1 nw ne sw se' with the state of each cell.
+#The last node is the root, and its centre is the origin.
+HEADER = '[M2] (pocketlife)'
+EXTENSION = '.mc'
+def ismacrocell(filename):
+    '''Checks whether a file holds a macrocell pattern.'''
+    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read(4) == '[M2]'
+def readlines(source, chunksize=1 << 16):
+    '''Yields the lines of a string, file object or iterable of strings, read in chunks.'''
+    carry = ''
+    for chunk in readchunks(source, chunksize):
+        lines = (carry + chunk).split('\n')
+        carry = lines.pop()
+        yield from lines
+    if carry:
+        yield carry
+def readleaf(line):
+    '''Converts an 8x8 leaf line into a list of its live cells.'''
+    cells = []
+    x = 0
+    y = 0
+    for character in line:
+        if character == '*':
+            cells.append((x, y, 1))
+            x += 1
+        elif character == '.':
+            x += 1
+        elif character == '$':
+            x = 0
+            y += 1
+    return cells
+def readmacrocell(source, chunksize=1 << 16):
+    '''Parses a macrocell pattern from a string, file object or iterable of strings, returning the rule (or None) and a grid.
+Each distinct node is parsed once, and only the cells themselves are expanded.'''
+    rule = None
+    #Each node is (level, children, None), or (level, None, cells) for leaves:
+    nodes = [None]
+    for line in readlines(source, chunksize):
+        line = line.strip()
+        if line.startswith('#R'):
+            rule = line[2:].strip()
+            continue
+        if len(line) == 0 or line[0] in '#[':
+            continue
+        if line[0] in '.*$':
+            nodes.append((3, None, readleaf(line)))
+            continue
+        try:
+            numbers = [int(x) for x in line.split()]
+        except ValueError:
+            raise ValueError('Invalid macrocell line: '+line)
+        if len(numbers) != 5:
+            raise ValueError('Invalid macrocell line: '+line)
+        level = numbers[0]
+        if level == 1:
+            states = numbers[1:]
+            cells = [(x, y, states[x + 2 * y]) for y in range(2) for x in range(2) if states[x + 2 * y] != 0]
+            nodes.append((1, None, cells))
+            continue
+        for child in numbers[1:]:
+            if child >= len(nodes) or (child != 0 and nodes[child][0] != level - 1):
+                raise ValueError('Invalid macrocell line: '+line)
+        nodes.append((level, numbers[1:], None))
+    grid = {}
+    if len(nodes) == 1:
+        return rule, grid
+    level = nodes[-1][0]
+    stack = [(len(nodes) - 1, -(1 << (level - 1)), -(1 << (level - 1)))]
+    while stack:
+        index, x, y = stack.pop()
+        level, children, cells = nodes[index]
+        if children is None:
+            for cx, cy, state in cells:
+                grid[(x + cx, y + cy)] = state
+            continue
+        half = 1 << (level - 1)
+        for child, (dx, dy) in zip(children, ((0, 0), (half, 0), (0, half), (half, half))):
+            if child != 0:
+                stack.append((child, x + dx, y + dy))
+    return rule, grid
+def writeleaf(rows):
+    '''Writes an 8x8 leaf given as 8 row bitmasks, as Golly does: dead cells and row ends are only written before a live cell.'''
+    line = []
+    dollars = 0
+    for row in rows:
+        dots = 0
+        for x in range(8):
+            if (row >> x) & 1:
+                line.append('$' * dollars + '.' * dots + '*')
+                dollars = 0
+                dots = 0
+            else:
+                dots += 1
+        dollars += 1
+    return ''.join(line) + '$'
+def writemacrocell(grid, rule, write, multistate=False):
+    '''Writes a grid as a macrocell pattern, passing each line to write as soon as its node is complete.
+Identical subtrees are only written once, so regular patterns take space in proportion to their distinct structure.'''
+    write(HEADER + '\n')
+    write('#R ' + rule + '\n')
+    cells = [(x, y, grid[(x, y)]) for x, y in grid if grid[(x, y)] != 0]
+    if len(cells) == 0:
+        return
+    #The root is centred on the origin, so it must reach the furthest cell in every direction:
+    reach = max(max(-x, x + 1, -y, y + 1) for x, y, state in cells)
+    leaflevel = 1 if multistate else 3
+    #The root is kept above the leaves, as in files written by Golly:
+    level = leaflevel + 1
+    while (1 << (level - 1)) < reach:
+        level += 1
+    offset = 1 << (level - 1)
+    cells = [(x + offset, y + offset, state) for x, y, state in cells]
+    numbers = {}
+    def writenode(cells, level):
+        if len(cells) == 0:
+            return 0
+        if level == leaflevel:
+            if multistate:
+                states = [0] * 4
+                for x, y, state in cells:
+                    states[x + 2 * y] = state
+                key = (1,) + tuple(states)
+                line = ' '.join(map(str, key))
+            else:
+                rows = [0] * 8
+                for x, y, state in cells:
+                    rows[y] |= 1 << x
+                key = tuple(rows)
+                line = None
+        else:
+            half = 1 << (level - 1)
+            quads = ([], [], [], [])
+            for x, y, state in cells:
+                quads[(x >= half) + 2 * (y >= half)].append((x % half, y % half, state))
+            key = (level,) + tuple(writenode(quad, level - 1) for quad in quads)
+            line = ' '.join(map(str, key))
+        if key not in numbers:
+            numbers[key] = len(numbers) + 1
+            write((line if line is not None else writeleaf(key)) + '\n')
+        return numbers[key]
+    writenode(cells, level)
@@ -0,0 +1,223 @@
+'''A dense engine that steps the live region of a grid as a NumPy array, packed 64 cells to a word where the rule allows.'''
+import itertools
+try:
+    import numpy as np
+except ImportError:
+    np = None
+def outertotalistic(table):
+    '''Returns the birth and survival counts of a transition table, or None if it depends on more than the number of live neighbours.'''
+    births = set()
+    survivals = set()
+    #Bit 4 is the centre cell:
+    for index in range(512):
+        if table[index]:
+            (survivals if index & 16 else births).add(bin(index & ~16).count('1'))
+    for index in range(512):
+        count = bin(index & ~16).count('1')
+        if (count in (survivals if index & 16 else births)) != bool(table[index]):
+            return None
+    return sorted(births), sorted(survivals)
+class NumpyEngine:
+    '''Advances dense grids with a 512-entry lookup table, falling back to a sparse stepper.
+Generations rules with more than two states store the state of each cell in the array.
+Two-state outer totalistic rules (such as b3s23) are stepped on bit-packed rows with bitwise adders instead.'''
+    def __init__(self, table, states=2, mindensity=1/32, smallarea=4096, margin=16, packeddensity=1/4096):
+        if np is None:
+            raise ImportError('The numpy engine requires NumPy to be installed.')
+        self.mindensity = mindensity
+        #Bit-packed rows cost so little per cell that far sparser patterns are still worth stepping as arrays:
+        self.packeddensity = packeddensity
+        self.smallarea = smallarea
+        #Patterns grow by at most one cell per generation, so the dead margin
+        #only needs to be restored every margin - 1 generations:
+        self.checkinterval = margin - 1
+        self.margin = margin
+        self.states = states
+        lut = np.frombuffer(table, dtype=np.uint8).copy()
+        #The sparse engine never sees empty neighbourhoods, so neither should this one:
+        lut[0] = 0
+        self.lut = lut
+        #Birth and survival counts, for rules that can be stepped bit-packed:
+        self.counts = outertotalistic(table) if states == 2 else None
+        #The padded neighbourhood array used by step, reused while the array keeps its shape:
+        self.padded = None
+    def isdense(self, population, area):
+        '''Checks whether a bounding box is small or dense enough to use arrays.'''
+        mindensity = self.mindensity if self.counts is None else self.packeddensity
+        return area <= self.smallarea or population >= area * mindensity
+    def toarray(self, grid):
+        '''Converts a grid to an array with a dead border, returning the array and its top-left corner.'''
+        cells = np.fromiter(itertools.chain.from_iterable(grid), dtype=np.int64, count=2 * len(grid)).reshape(-1, 2)
+        values = np.fromiter(grid.values(), dtype=np.uint8, count=len(grid))
+        margin = self.margin
+        x = int(cells[:, 0].min()) - margin
+        y = int(cells[:, 1].min()) - margin
+        w = int(cells[:, 0].max()) - x + margin + 1
+        h = int(cells[:, 1].max()) - y + margin + 1
+        array = np.zeros((h, w), dtype=np.uint8)
+        array[cells[:, 1] - y, cells[:, 0] - x] = values
+        return array, x, y
+    def togrid(self, array, x, y):
+        '''Converts an array with its top-left corner at (x, y) back into a grid.'''
+        whys, exes = np.nonzero(array)
+        cells = zip((exes + x).tolist(), (whys + y).tolist())
+        if self.states == 2:
+            return dict.fromkeys(cells, 1)
+        return dict(zip(cells, array[whys, exes].tolist()))
+    def pack(self, array):
+        '''Packs the rows of an array into words of 64 cells, with cell x of a row in bit x % 64 of word x // 64.'''
+        h, w = array.shape
+        padded = np.zeros((h, -(-w // 64) * 64), dtype=np.uint8)
+        padded[:, :w] = array
+        return np.packbits(padded, axis=1, bitorder='little').view('<u8').astype(np.uint64)
+    def unpack(self, words):
+        '''Unpacks words made by pack into an array.'''
+        return np.unpackbits(words.astype('<u8').view(np.uint8), axis=1, bitorder='little')
+    def countmask(self, sums, count):
+        '''Returns the words with a bit set where the four bit-planes of a neighbour count equal count.'''
+        mask = None
+        for bit, plane in enumerate(sums):
+            if bit == 3 and 0 < count < 8:
+                #A count of 8 has its lower bits clear, so they already rule it out:
+                continue
+            term = plane if (count >> bit) & 1 else ~plane
+            mask = term if mask is None else mask & term
+        return mask
+    def packedstep(self, words):
+        '''Advances bit-packed rows by one generation of an outer totalistic rule, adding up neighbours with bitwise adders.
+The outermost ring must be dead.'''
+        one = np.uint64(1)
+        top = np.uint64(63)
+        #The cells to the west and east of each cell, carrying bits across words:
+        west = words << one
+        west[:, 1:] |= words[:, :-1] >> top
+        east = words >> one
+        east[:, :-1] |= words[:, 1:] << top
+        #Each row as two-bit sums of the two cells beside each cell (l) and of all three cells (h):
+        l0 = west ^ east
+        l1 = west & east
+        h0 = l0 ^ words
+        h1 = l1 | (l0 & words)
+        #Add the rows above and below to the middle row, giving a four-bit count of the eight neighbours:
+        u0, u1, d0, d1, m0, m1 = h0[:-2], h1[:-2], h0[2:], h1[2:], l0[1:-1], l1[1:-1]
+        x0 = u0 ^ d0
+        c0 = (u0 & d0) | (x0 & m0)
+        x1 = u1 ^ d1
+        x2 = x1 ^ m1
+        c1 = (u1 & d1) | (x1 & m1)
+        c2 = x2 & c0
+        sums = (x0 ^ m0, x2 ^ c0, c1 ^ c2, c1 & c2)
+        centre = words[1:-1]
+        births, survivals = self.counts
+        result = np.zeros_like(words)
+        alive = result[1:-1]
+        for count in sorted(set(births) | set(survivals)):
+            mask = self.countmask(sums, count)
+            if count not in survivals:
+                mask &= ~centre
+            elif count not in births:
+                mask &= centre
+            alive |= mask
+        return result
+    def packedregrow(self, words, x, y):
+        '''Crops bit-packed rows to their live cells, keeping a dead margin of rows and a dead word at either end of each row.
+Returns the words, their top-left corner, the population and the area of the bounding box.'''
+        rows = np.flatnonzero(words.any(axis=1))
+        if len(rows) == 0:
+            return words[:0, :0], x, y, 0, 0
+        columns = np.bitwise_or.reduce(words[rows[0]:rows[-1] + 1], axis=0)
+        used = np.flatnonzero(columns)
+        w0, w1 = int(used[0]), int(used[-1])
+        margin = self.margin
+        y0, y1 = int(rows[0]), int(rows[-1])
+        newwords = np.zeros((y1 - y0 + 2 * margin + 1, w1 - w0 + 3), dtype=np.uint64)
+        newwords[margin:-margin, 1:-1] = words[y0:y1 + 1, w0:w1 + 1]
+        #The first and last live columns, from the bits of the outermost live words:
+        bits = self.unpack(columns[[w0, w1]].reshape(1, 2))[0]
+        left = int(np.flatnonzero(bits[:64])[0])
+        right = 64 * (w1 - w0) + int(np.flatnonzero(bits[64:])[-1])
+        population = int(np.count_nonzero(self.unpack(newwords)))
+        return newwords, x + 64 * (w0 - 1), y + y0 - margin, population, (right - left + 1) * (y1 - y0 + 1)
+    def step(self, array):
+        '''Advances an array by one generation. The outermost ring must be dead.'''
+        h, w = array.shape
+        if self.padded is None or self.padded.shape != (h + 2, w + 2):
+            self.padded = np.zeros((h + 2, w + 2), dtype=np.uint16)
+        #Only the inside is written, so the border of the reused array stays dead:
+        padded = self.padded
+        if self.states > 2:
+            #Only cells in state 1 count as neighbours:
+            padded[1:-1, 1:-1] = array == 1
+        else:
+            padded[1:-1, 1:-1] = array
+        #Bit (ox + 3 * oy) holds the cell at offset (ox - 1, oy - 1):
+        rows = padded[:, :w] | (padded[:, 1:w + 1] << 1) | (padded[:, 2:] << 2)
+        index = rows[:h] | (rows[1:h + 1] << 3) | (rows[2:] << 6)
+        if self.states == 2:
+            return np.take(self.lut, index)
+        #Cells that are alive next generation become state 1, unless they are decaying;
+        #everything else that is not dead moves up a state, reaching state 0 after the last one:
+        decayed = array + (array > 0)
+        decayed[decayed >= self.states] = 0
+        alive = (np.take(self.lut, index) == 1) & (array <= 1)
+        return np.where(alive, np.uint8(1), decayed).astype(np.uint8)
+    def regrow(self, array, x, y):
+        '''Crops an array to its live cells plus a dead margin.'''
+        whys, exes = np.nonzero(array)
+        if len(whys) == 0:
+            return array[:0, :0], x, y
+        margin = self.margin
+        x0, x1 = int(exes.min()), int(exes.max())
+        y0, y1 = int(whys.min()), int(whys.max())
+        newarray = np.zeros((y1 - y0 + 2 * margin + 1, x1 - x0 + 2 * margin + 1), dtype=np.uint8)
+        newarray[margin:-margin, margin:-margin] = array[y0:y1 + 1, x0:x1 + 1]
+        return newarray, x + x0 - margin, y + y0 - margin
+    def advancepacked(self, grid, gens):
+        '''Advances a dense grid as bit-packed rows until gens generations have passed or it is no longer dense.
+Returns the grid and the number of generations left.'''
+        array, x, y = self.toarray(grid)
+        words, x, y, population, area = self.packedregrow(self.pack(array), x, y)
+        while gens > 0:
+            for _ in range(min(gens, self.checkinterval)):
+                words = self.packedstep(words)
+            gens -= min(gens, self.checkinterval)
+            words, x, y, population, area = self.packedregrow(words, x, y)
+            if population == 0:
+                return {}, 0
+            if not self.isdense(population, area):
+                break
+        return self.togrid(self.unpack(words), x, y), gens
+    def advance(self, grid, gens, sparsestep):
+        '''Advance a grid a specific number of generations.'''
+        while gens > 0:
+            grid = {c: grid[c] for c in grid if grid[c] != 0}
+            if len(grid) == 0:
+                return grid
+            exes = [c[0] for c in grid]
+            whys = [c[1] for c in grid]
+            area = (max(exes) - min(exes) + 1) * (max(whys) - min(whys) + 1)
+            if not self.isdense(len(grid), area):
+                #Sparse patterns are cheaper to step as a dictionary:
+                for _ in range(min(gens, self.checkinterval)):
+                    grid = sparsestep(grid)
+                gens -= min(gens, self.checkinterval)
+                continue
+            if self.counts is not None:
+                grid, gens = self.advancepacked(grid, gens)
+                continue
+            array, x, y = self.toarray(grid)
+            while gens > 0:
+                for _ in range(min(gens, self.checkinterval)):
+                    array = self.step(array)
+                gens -= min(gens, self.checkinterval)
+                if gens > 0:
+                    array, x, y = self.regrow(array, x, y)
+                    population = int(np.count_nonzero(array))
+                    if population == 0:
+                        return {}
+                    margin = 2 * self.margin
+                    area = (array.shape[0] - margin) * (array.shape[1] - margin)
+                    if not self.isdense(population, area):
+                        break
+            grid = self.togrid(array, x, y)
+        return grid
@@ -0,0 +1,154 @@
+'''A streaming, linear-time reader and writer for Run Length Encoded (RLE) patterns.'''
+import re
+#Counts, comment or header lines, operators (with an optional state prefix) and whitespace:
+TOKENS = re.compile(r'(\d+)|(#[^\n]*|x\s*=[^\n]*)(\n?)|([p-y]?[A-X]|[^\d\s])|\s+')
+#A prefix or header 'x' at the end of a chunk, which needs the start of the next chunk:
+TAIL = re.compile(r'[p-y]\s*$')
+#Multi-state RLEs use . for state 0, A to X for states 1 to 24, and pA to yO for states 25 to 255:
+STATELETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWX'
+STATEPREFIXES = 'pqrstuvwxy'
+def readchunks(source, chunksize=1 << 16):
+    '''Yields pieces of text from a string, a file object or an iterable of strings.'''
+    if isinstance(source, str):
+        for x in range(0, len(source), chunksize):
+            yield source[x:x + chunksize]
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunksize)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+def alignchunks(chunks):
+    '''Moves a trailing state prefix or header 'x' onto the next chunk, so that tokens are never split.'''
+    carry = ''
+    for chunk in chunks:
+        chunk = carry + chunk
+        match = TAIL.search(chunk)
+        carry = chunk[match.start():] if match else ''
+        yield chunk[:len(chunk) - len(carry)]
+    if carry:
+        yield carry
+def tostate(operator):
+    '''Converts a multi-state RLE operator into a state, or None if it is not a cell.'''
+    if operator in 'b.':
+        return 0
+    if operator == 'o':
+        return 1
+    if operator[-1] not in STATELETTERS:
+        return None
+    state = STATELETTERS.index(operator[-1]) + 1
+    if len(operator) > 1:
+        state += 24 * (STATEPREFIXES.index(operator[0]) + 1)
+    return state
+def fromstate(state):
+    '''Converts a state into a multi-state RLE operator.'''
+    if state == 0:
+        return '.'
+    if state <= 24:
+        return STATELETTERS[state - 1]
+    return STATEPREFIXES[(state - 1) // 24 - 1] + STATELETTERS[(state - 1) % 24]
+def readrle(source, chunksize=1 << 16, multistate=False):
+    '''Parses an RLE, yielding rows of live cells as (y, [x, ...]), or (y, [x, ...], [state, ...]) if multistate is True.
+A row may be yielded in several pieces, but rows are always yielded in order.'''
+    x = 0
+    y = 0
+    count = ''
+    skipping = False
+    for chunk in alignchunks(readchunks(source, chunksize)):
+        xs = []
+        states = []
+        position = 0
+        if skipping:
+            #Finish a header or comment line from the previous chunk:
+            position = chunk.find('\n')
+            if position < 0:
+                continue
+            skipping = False
+        for digits, header, newline, operator in TOKENS.findall(chunk, position):
+            if digits:
+                count += digits
+                continue
+            if header:
+                skipping = newline == ''
+                continue
+            if not operator:
+                continue
+            integer = int(count) if count else 1
+            count = ''
+            if operator == 'o' and not multistate:
+                xs.extend(range(x, x + integer))
+                x += integer
+            elif operator == 'b':
+                x += integer
+            elif operator == '$':
+                if xs:
+                    yield (y, xs, states) if multistate else (y, xs)
+                    xs = []
+                    states = []
+                x = 0
+                y += integer
+            elif operator == '!':
+                if xs:
+                    yield (y, xs, states) if multistate else (y, xs)
+                return
+            elif multistate:
+                state = tostate(operator)
+                if state:
+                    xs.extend(range(x, x + integer))
+                    states.extend([state] * integer)
+                if state is not None:
+                    x += integer
+        if xs:
+            yield (y, xs, states) if multistate else (y, xs)
+def writerle(rows, bbox, rule, write, width=70, multistate=False):
+    '''Writes an RLE from rows of live cells given as (y, sorted [x, ...]) in increasing y.
+If multistate is True, rows are (y, [x, ...], [state, ...]) and states are written as letters.
+Text is passed to write in pieces, and lines are kept to at most width characters.'''
+    if bbox is None:
+        #Empty patterns do not have a proper bounding box.
+        bbox = [0, 0, 0, 0]
+    write('x = '+str(bbox[2])+', y = '+str(bbox[3])+', rule = '+rule+'\n')
+    dead = '.' if multistate else 'b'
+    line = []
+    linelength = 0
+    def emit(token):
+        nonlocal linelength
+        if linelength + len(token) > width:
+            write(''.join(line) + '\n')
+            line.clear()
+            linelength = 0
+        line.append(token)
+        linelength += len(token)
+    def run(n, operator):
+        if n == 1:
+            emit(operator)
+        elif n > 1:
+            emit(str(n) + operator)
+    lasty = bbox[1]
+    for row in rows:
+        y, xs = row[0], row[1]
+        if multistate:
+            operators = [fromstate(state) for state in row[2]]
+        else:
+            operators = ['o'] * len(xs)
+        run(y - lasty, '$')
+        lasty = y
+        position = bbox[0]
+        start = xs[0]
+        previous = start - 1
+        operator = operators[0]
+        for x, nextoperator in zip(xs, operators):
+            if x != previous + 1 or nextoperator != operator:
+                run(start - position, dead)
+                run(previous - start + 1, operator)
+                position = previous + 1
+                start = x
+                operator = nextoperator
+            previous = x
+        run(start - position, dead)
+        run(previous - start + 1, operator)
+    emit('!')
+    write(''.join(line) + '\n')